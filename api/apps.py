@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Create serializers of all product types once.
+        from products.registry import register_serializers
+        from .serializers import ProductSpecificDetailSerializer, ProductSpecificListSerializer
+        register_serializers('detail', ProductSpecificDetailSerializer.for_model)
+        register_serializers('list', ProductSpecificListSerializer.for_model)
@@ -1,7 +1,8 @@
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .serializers import ProductSpecificDetailSerializer, ProductSpecificListSerializer, ProductSerializer
+from .serializers import ProductSpecificDetailSerializer, ProductSerializer
 from products.models import Product
+from products.registry import get_product_type
 from django.shortcuts import get_object_or_404
 from rest_framework import status,permissions, authentication
 from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
@@ -61,8 +62,7 @@ class ProductDetailRenderer(BrowsableAPIRenderer):
             product_serializer = ProductSerializer(instance=product, context=context)
             put_form = self.render_form_for_serializer(product_serializer)
             # POST form - ProductSpecific
-            product_specific_model = product.get_product_specific_model()
-            serializer = ProductSpecificDetailSerializer(model=product_specific_model, context=context)
+            serializer = get_product_type(product.type).serializers['detail'](context=context)
             # Remove product field from form.
             serializer.fields.pop('product')
             post_form = self.render_form_for_serializer(serializer)
@@ -102,7 +102,7 @@ class ProductDetailView(APIView):
         context = {'request': request}
         data = request.data.copy()
         data['product'] = product.pk
-        serializer = ProductSpecificDetailSerializer(data=data, context=context)
+        serializer = get_product_type(product.type).serializers['detail'](data=data, context=context)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -117,7 +117,8 @@ class ProductSpecificDetailView(APIView):
     def get(self, request, product_pk, product_specific_pk):
         context = {'request': request}
         product_specific = Product.get_product_specific(product_pk, product_specific_pk)
-        serializer = ProductSpecificDetailSerializer(product_specific, many=False, context=context)
+        serializer = get_product_type(product_specific.TYPE).serializers['detail'](product_specific, many=False,
+                                                                                   context=context)
         return Response(serializer.data)
 
     def delete(self, request, product_pk, product_specific_pk):
@@ -128,7 +129,8 @@ class ProductSpecificDetailView(APIView):
     def put(self, request, product_pk, product_specific_pk):
         context = {'request': request}
         product_specific = Product.get_product_specific(product_pk, product_specific_pk)
-        serializer = ProductSpecificDetailSerializer(instance=product_specific, data=request.data, context=context)
+        serializer = get_product_type(product_specific.TYPE).serializers['detail'](
+            instance=product_specific, data=request.data, context=context)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,13 @@
+from django.contrib import admin
+from .models import OutgoingEmail
+
+# Register your models here.
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'recipients', 'status', 'attempts', 'created', 'sent')
+    list_filter = ('status',)
+    readonly_fields = ('attempts', 'last_error', 'created', 'sent')
+
+
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from mailing.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = "Send emails waiting in outbox in batches, reusing one SMTP connection for each batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Number of emails sent in one batch.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking outbox for new emails.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds between outbox checks in loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = self.send_batch(options['batch_size'])
+            if not options['loop']:
+                break
+            # Sleep only when outbox is empty.
+            if not sent:
+                time.sleep(options['sleep'])
+
+    def claim_batch(self, batch_size):
+        # Claim batch of pending emails by moving their next attempt by lease time and committing, so other workers
+        # skip them while they are sent without holding row locks. If worker stops before saving results, emails are
+        # sent again after lease time.
+        with transaction.atomic():
+            now = timezone.now()
+            emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True)
+                          .filter(status=OutgoingEmail.PENDING, next_attempt__lte=now)
+                          .order_by('id')[:batch_size])
+            OutgoingEmail.objects.filter(id__in=[email.id for email in emails]) \
+                .update(next_attempt=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_TIME))
+        return emails
+
+    def send_batch(self, batch_size):
+        # Send one batch of pending emails. Returns number of processed emails.
+        emails = self.claim_batch(batch_size)
+        if not emails:
+            return 0
+        batch_start = time.perf_counter()
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            # Connection failed - retry whole batch later.
+            self.stderr.write(f"Connection error: {error}")
+            for email in emails:
+                email.mark_failed_attempt(error)
+            OutgoingEmail.objects.bulk_update(emails, ['attempts', 'last_error', 'status', 'next_attempt'])
+            return len(emails)
+        try:
+            for email in emails:
+                self.send_email(connection, email)
+        finally:
+            connection.close()
+            OutgoingEmail.objects.bulk_update(emails, ['attempts', 'last_error', 'status', 'next_attempt', 'sent'])
+        batch_time = time.perf_counter() - batch_start
+        self.stdout.write(f"Batch of {len(emails)} emails processed in {batch_time*1000:.1f} ms.")
+        return len(emails)
+
+    def send_email(self, connection, email):
+        start = time.perf_counter()
+        message = EmailMessage(subject=email.subject, body=email.message, from_email=email.from_email,
+                               to=email.recipient_list, connection=connection)
+        try:
+            message.send()
+        except Exception as error:
+            email.mark_failed_attempt(error)
+            self.stderr.write(f"Email {email.id} failed (attempt {email.attempts}): {error}")
+        else:
+            email.mark_sent()
+            latency = (time.perf_counter() - start) * 1000
+            self.stdout.write(f"Email {email.id} sent in {latency:.1f} ms.")
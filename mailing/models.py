@@ -0,0 +1,65 @@
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+
+# Create your models here.
+
+
+class OutgoingEmail(models.Model):
+    # Email waiting in outbox. Emails are saved by request handlers and sent by send_emails management command.
+    PENDING = "1"
+    SENT = "2"
+    FAILED = "3"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField()
+    status = models.CharField(choices=STATUS_CHOICES, default=PENDING, max_length=2)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='email_status_next_attempt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}-{self.subject} ({self.get_status_display()})"
+
+    @property
+    def recipient_list(self):
+        return self.recipients.split(',')
+
+    def mark_failed_attempt(self, error):
+        # Schedule next attempt with exponential backoff or mark email as failed after too many attempts.
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt = timezone.now() + timedelta(seconds=delay)
+
+    def mark_sent(self):
+        self.attempts += 1
+        self.status = self.SENT
+        self.sent = timezone.now()
+        self.last_error = ''
+
+
+def enqueue_email(subject, message, from_email, recipient_list, commit=True):
+    # Save email in outbox to be sent by worker. Used instead of send_mail in request handlers.
+    # With commit=False unsaved email is returned, so many emails can be saved with bulk_create.
+    email = OutgoingEmail(subject=subject, message=message, from_email=from_email, recipients=','.join(recipient_list))
+    if commit:
+        email.save()
+    return email
@@ -0,0 +1,125 @@
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPException
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .management.commands.send_emails import Command as SendEmailsCommand
+from .models import OutgoingEmail, enqueue_email
+
+# Create your tests here.
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    # Backend which can't send any message.
+    def send_messages(self, email_messages):
+        raise SMTPException("Sending failed.")
+
+
+class UnavailableEmailBackend(BaseEmailBackend):
+    # Backend which can't connect to server.
+    def open(self):
+        raise ConnectionRefusedError("Connection refused.")
+
+
+def send_emails():
+    call_command('send_emails', stdout=StringIO(), stderr=StringIO())
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=3,
+                   EMAIL_OUTBOX_RETRY_DELAY=60)
+class OutgoingEmailTest(TestCase):
+
+    def enqueue(self, subject='Subject'):
+        return enqueue_email(subject, 'Message', 'shop@example.com', ['user@example.com', 'other@example.com'])
+
+    def make_due(self, email):
+        OutgoingEmail.objects.filter(id=email.id).update(next_attempt=timezone.now())
+
+    def test_enqueue_email_saves_pending_email(self):
+        email = self.enqueue()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.recipient_list, ['user@example.com', 'other@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+        unsaved = enqueue_email('Subject', 'Message', 'shop@example.com', ['user@example.com'], commit=False)
+        self.assertIsNone(unsaved.id)
+
+    def test_send_emails_sends_pending_emails(self):
+        emails = [self.enqueue(f'Subject {i}') for i in range(3)]
+        send_emails()
+        self.assertEqual([message.subject for message in mail.outbox], [email.subject for email in emails])
+        self.assertEqual(mail.outbox[0].to, ['user@example.com', 'other@example.com'])
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutgoingEmail.SENT)
+            self.assertEqual(email.attempts, 1)
+            self.assertIsNotNone(email.sent)
+        # Sent emails are not sent again.
+        send_emails()
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_emails_waiting_for_next_attempt_are_not_sent(self):
+        email = self.enqueue()
+        OutgoingEmail.objects.filter(id=email.id).update(next_attempt=timezone.now() + timedelta(minutes=1))
+        send_emails()
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_BACKEND='mailing.tests.FailingEmailBackend')
+    def test_failed_email_is_retried_with_exponential_backoff(self):
+        email = self.enqueue()
+        start = timezone.now()
+        send_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "Sending failed.")
+        self.assertGreaterEqual(email.next_attempt, start + timedelta(seconds=60))
+        # Not retried before next attempt time.
+        send_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.make_due(email)
+        start = timezone.now()
+        send_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        self.assertGreaterEqual(email.next_attempt, start + timedelta(seconds=120))
+        self.assertLess(email.next_attempt, start + timedelta(seconds=180))
+        # Last attempt marks email as failed.
+        self.make_due(email)
+        send_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(email.attempts, 3)
+
+    @override_settings(EMAIL_BACKEND='mailing.tests.UnavailableEmailBackend')
+    def test_connection_error_schedules_retry_of_whole_batch(self):
+        emails = [self.enqueue(f'Subject {i}') for i in range(2)]
+        send_emails()
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutgoingEmail.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(email.last_error, "Connection refused.")
+
+    def test_mark_failed_attempt(self):
+        email = self.enqueue()
+        start = timezone.now()
+        email.mark_failed_attempt(SMTPException("Error"))
+        self.assertEqual((email.status, email.attempts, email.last_error), (OutgoingEmail.PENDING, 1, "Error"))
+        self.assertGreaterEqual(email.next_attempt, start + timedelta(seconds=60))
+        email.mark_failed_attempt(SMTPException("Error"))
+        self.assertGreaterEqual(email.next_attempt, start + timedelta(seconds=120))
+        email.mark_failed_attempt(SMTPException("Error"))
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.FAILED, 3))
+
+    def test_claimed_emails_are_skipped_by_other_workers(self):
+        email = self.enqueue()
+        self.assertEqual(SendEmailsCommand().claim_batch(10), [email])
+        # Emails are claimed until lease time passes, even after transaction is committed.
+        self.assertEqual(SendEmailsCommand().claim_batch(10), [])
+        self.make_due(email)
+        self.assertEqual(SendEmailsCommand().claim_batch(10), [email])
@@ -1,9 +1,18 @@
 from django.contrib import admin
-from .models import Order, OrderProducts
+from .models import Order, OrderProducts, StripeEvent
 # Register your models here.
 
 class OrderProductsAdmin(admin.ModelAdmin):
-    readonly_fields = ["product_name", "product_price"]
+    readonly_fields = ["product_name", "product_price", "stripe_price_id"]
 
 admin.site.register(Order)
-admin.site.register(OrderProducts, OrderProductsAdmin)
\ No newline at end of file
+admin.site.register(OrderProducts, OrderProductsAdmin)
+
+
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ["event_id", "type", "created", "processed", "attempts"]
+    list_filter = ["type"]
+    readonly_fields = ["event_id", "type", "payload", "created", "received"]
+
+
+admin.site.register(StripeEvent, StripeEventAdmin)
\ No newline at end of file
@@ -0,0 +1,116 @@
+import threading
+import time
+import stripe
+from django.conf import settings
+from .models import Order
+
+# Stripe checkout client used by send_payment_links command. Checkout sessions are not created in request handlers,
+# so response time of order pages doesn't depend on Stripe. Dedicated HTTP client with timeouts and circuit breaker
+# stop the worker from waiting for slow or unavailable Stripe API, such orders are retried in next runs.
+
+# Connections are kept open and reused by requests session of this client. Global stripe HTTP client used by other
+# modules is not changed.
+http_client = stripe.http_client.RequestsClient(timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT))
+
+
+class CheckoutUnavailable(Exception):
+    # Stripe is not available, checkout can be retried later.
+    pass
+
+
+class CheckoutFailed(Exception):
+    # Stripe rejected checkout request, retrying it won't help.
+    pass
+
+
+class CircuitBreaker:
+    # After failure_threshold consecutive failures calls are rejected for reset_timeout seconds. Then one trial
+    # call is allowed, its success closes the circuit.
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Allow one trial call, other calls wait for its result.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+circuit_breaker = CircuitBreaker(settings.STRIPE_FAILURE_THRESHOLD, settings.STRIPE_RESET_TIMEOUT)
+
+
+def get_line_items(order):
+    # Build Stripe line items from order products with one query. Stripe price saved when order was placed is used if
+    # it exists, otherwise price is created from name and price saved in order.
+    return [
+        {'price': stripe_price_id, 'quantity': amount} if stripe_price_id else
+        {'price_data': {'currency': settings.STRIPE_CURRENCY, 'unit_amount': int(product_price*100),
+                        'product_data': {'name': product_name}},
+         'quantity': amount}
+        for product_name, product_price, stripe_price_id, amount in
+        order.order_products.order_by('id').values_list('product_name', 'product_price', 'stripe_price_id', 'amount')
+    ]
+
+
+def create_stripe_checkout_session(http_client, **params):
+    # Create checkout session with given HTTP client.
+    requestor = stripe.api_requestor.APIRequestor(key=settings.STRIPE_SECRET_KEY, client=http_client,
+                                                  api_base=settings.STRIPE_API_BASE)
+    response, api_key = requestor.request('post', stripe.checkout.Session.class_url(), params)
+    return stripe.util.convert_to_stripe_object(response, api_key)
+
+
+def create_checkout_session(order, success_url, cancel_url):
+    # Create Stripe checkout session for order and save its id. Returns checkout url or None if order has no products.
+    # Raises CheckoutUnavailable if Stripe is not available. Raises CheckoutFailed if Stripe rejected request, order is
+    # then marked with checkout error and it is not retried.
+    line_items = get_line_items(order)
+    if not line_items:
+        return None
+    if not circuit_breaker.allow():
+        raise CheckoutUnavailable("Stripe temporarily disabled after repeated failures.")
+    try:
+        stripe_checkout_session = create_stripe_checkout_session(
+            http_client,
+            line_items=line_items,
+            mode="payment",
+            success_url=success_url,
+            cancel_url=cancel_url,
+            customer_email=order.email,
+        )
+    except (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError) as error:
+        # Connection errors (including timeouts) and Stripe server errors.
+        circuit_breaker.record_failure()
+        raise CheckoutUnavailable(str(error))
+    except stripe.error.StripeError as error:
+        # Stripe is available, but request was rejected.
+        circuit_breaker.record_success()
+        order.checkout_pending = False
+        order.checkout_error = str(error)[:255]
+        Order.objects.filter(id=order.id).update(checkout_pending=False, checkout_error=order.checkout_error)
+        raise CheckoutFailed(str(error))
+    circuit_breaker.record_success()
+    order.stripe_checkout_id = stripe_checkout_session.stripe_id
+    order.checkout_pending = False
+    Order.objects.filter(id=order.id).update(stripe_checkout_id=order.stripe_checkout_id, checkout_pending=False)
+    return stripe_checkout_session.url
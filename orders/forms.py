@@ -6,4 +6,5 @@ class OrderForm(ModelForm):
 
     class Meta:
         model = Order
-        exclude = ['user', 'product_count', 'total', 'status', 'confirmed', 'stripe_checkout_id']
+        exclude = ['user', 'product_count', 'total', 'status', 'confirmed', 'stripe_checkout_id', 'total_value',
+                   'total_items', 'checkout_pending', 'checkout_error']
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from orders.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = "Apply Stripe webhook events received by stripe_webhook view."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of events applied in one batch.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking for new events.")
+        parser.add_argument('--sleep', type=float, default=2, help="Seconds between checks in loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            processed, failed, updated = process_events(options['batch_size'])
+            if processed or failed:
+                self.stdout.write(f"Processed {processed} events ({failed} failed), {updated} orders paid "
+                                  f"in {(time.perf_counter() - start)*1000:.1f} ms.")
+            if not options['loop']:
+                break
+            # Process next batch immediately if there are more events.
+            if processed + failed < options['batch_size']:
+                time.sleep(options['sleep'])
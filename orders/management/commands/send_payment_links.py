@@ -0,0 +1,52 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from orders.checkout import create_checkout_session, CheckoutUnavailable, CheckoutFailed
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Create Stripe checkout sessions for confirmed orders and email payment links."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Maximum number of processed orders.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking for new orders.")
+        parser.add_argument('--sleep', type=float, default=2, help="Seconds between checks in loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.send_batch(options['batch_size'])
+            if not options['loop']:
+                break
+            # Process next batch immediately if there are more orders.
+            if processed < options['batch_size']:
+                time.sleep(options['sleep'])
+
+    def send_batch(self, batch_size):
+        # Returns number of processed orders, 0 if Stripe is unavailable, so loop waits before next batch.
+        success_url = settings.SITE_URL + reverse('orders:checkout_success')
+        cancel_url = settings.SITE_URL + reverse('orders:checkout_cancelled')
+        orders = list(Order.objects.filter(checkout_pending=True, confirmed=True, status=Order.WAIT_PAYMENT)
+                      .order_by('id')[:batch_size])
+        sent = 0
+        unavailable = False
+        for order in orders:
+            try:
+                checkout_url = create_checkout_session(order, success_url, cancel_url)
+            except CheckoutUnavailable as error:
+                self.stderr.write(f"Order {order.id}: {error}")
+                # Remaining orders are tried in next batch.
+                unavailable = True
+                break
+            except CheckoutFailed as error:
+                self.stderr.write(f"Order {order.id}: {error}")
+                continue
+            if checkout_url is not None:
+                order.send_payment_link_email(checkout_url)
+                sent += 1
+            else:
+                Order.objects.filter(id=order.id).update(checkout_pending=False)
+        if orders:
+            self.stdout.write(f"Sent {sent} payment links.")
+        return 0 if unavailable else len(orders)
@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 16:47
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_order_totals(apps, schema_editor):
+    # Calculate totals of existing orders.
+    Order = apps.get_model('orders', 'Order')
+    orders = list(Order.objects.annotate(value=Sum(F('order_products__product_price') * F('order_products__amount')),
+                                         items=Sum('order_products__amount')))
+    for order in orders:
+        order.total_value = order.value or 0
+        order.total_items = order.items or 0
+    Order.objects.bulk_update(orders, ['total_value', 'total_items'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0019_orderproducts_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_value',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'total_value'], name='order_user_value_idx'),
+        ),
+    ]
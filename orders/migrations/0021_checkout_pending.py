@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+def fill_stripe_price_ids(apps, schema_editor):
+    # Copy current Stripe prices of ordered product variants, grouped by content type. Price is copied only if its
+    # amount is equal to price saved in order.
+    OrderProducts = apps.get_model('orders', 'OrderProducts')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    for content_type in ContentType.objects.filter(id__in=OrderProducts.objects.values('content_type')):
+        model = apps.get_model(content_type.app_label, content_type.model)
+        prices = {object_id: (price_id, amount) for object_id, price_id, amount in model.objects
+                  .exclude(stripe_price_id=None).values_list('id', 'stripe_price_id', 'stripe_price_amount')}
+        order_products = [order_product for order_product in
+                          OrderProducts.objects.filter(content_type=content_type, object_id__in=prices)
+                          if prices[order_product.object_id][1] == int(order_product.product_price*100)]
+        for order_product in order_products:
+            order_product.stripe_price_id = prices[order_product.object_id][0]
+        OrderProducts.objects.bulk_update(order_products, ['stripe_price_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0020_order_totals'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('products', '0017_stripe_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_pending',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='orderproducts',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, max_length=220, null=True),
+        ),
+        migrations.RunPython(fill_stripe_price_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0022_stripe_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
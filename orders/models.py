@@ -2,11 +2,11 @@ from django.db import models
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
+from mailing.models import enqueue_email
 from .token_generator import order_confirmation_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.shortcuts import reverse
-from django.db.models import Sum
+from datetime import datetime, timezone
 
 # Create your models here.
 
@@ -34,7 +34,20 @@ class Order(models.Model):
     postal_code = models.CharField(max_length=50)
     status = models.CharField(choices=STATUS_CHOICES, default=WAIT_PAYMENT, max_length=40)
     confirmed = models.BooleanField(default=False)
-    stripe_checkout_id = models.CharField(max_length=220, blank=True, null=True)
+    stripe_checkout_id = models.CharField(max_length=220, blank=True, null=True, db_index=True)
+    # Checkout session is not created yet, payment link will be sent by send_payment_links command.
+    checkout_pending = models.BooleanField(default=False, db_index=True)
+    # Stripe rejected checkout session request, order needs to be fixed by staff.
+    checkout_error = models.CharField(max_length=255, blank=True, default='')
+    # Totals calculated when order is placed.
+    total_value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_items = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created'], name='order_user_created_idx'),
+            models.Index(fields=['user', 'total_value'], name='order_user_value_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id}-{self.email}"
@@ -47,7 +60,8 @@ class Order(models.Model):
                 f_name = 'get_' + field.name + '_display'
                 display = getattr(self, f_name)
                 value = display()
-            if name.lower() in ['id', 'user', 'created', 'modified', 'stripe checkout id']:
+            if name.lower() in ['id', 'user', 'created', 'modified', 'stripe checkout id', 'total value',
+                                'total items', 'checkout pending', 'checkout error']:
                 continue
             yield (name, value)
 
@@ -67,7 +81,7 @@ class Order(models.Model):
         message += "List of products: \n"
         i = 1
         for order_product in self.order_products.all():
-            message += f"{i}. {str(order_product.product_specific)} Amount: {order_product.amount}\n"
+            message += f"{i}. {order_product.product_name} Amount: {order_product.amount}\n"
             i += 1
         if not self.confirmed:
             oidb64 = urlsafe_base64_encode(str(self.id).encode())
@@ -79,32 +93,26 @@ class Order(models.Model):
         elif checkout_url is not None:
             message += f"\nYour order is confirmed. Link to payment:\n"
             message += checkout_url
-        send_mail(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
+        enqueue_email(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
 
-    def send_confirmation_ok_email(self, checkout_url):
+    def send_confirmation_ok_email(self, checkout_url=None):
         subject = f"Your Order nr: {self.id} is now confirmed."
         message = f"Your order has been successfully confirmed."
         if checkout_url is not None:
             message += f"\nLink to payment:\n"
             message += checkout_url
-        send_mail(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
+        enqueue_email(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
+
+    def send_payment_link_email(self, checkout_url):
+        subject = f"Payment link for order nr: {self.id}"
+        message = f"Your order nr: {self.id} is waiting for payment.\nLink to payment:\n{checkout_url}"
+        enqueue_email(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
 
-    def send_payment_ok_email(self):
+    def send_payment_ok_email(self, commit=True):
         subject = f"Order nr: {self.id} payment was successful."
         message = f"Payment for order nr: {self.id} was received.\nYour Django MyShop team."
-        send_mail(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email])
-
-    @property
-    def total_value(self):
-        value = 0
-        products = self.order_products.all()
-        for product in products:
-            value += product.product_price
-        return value
-
-    @property
-    def total_items(self):
-        return self.order_products.all().aggregate(Sum('amount')).get('amount__sum',0)
+        return enqueue_email(subject=subject, message=message, from_email="Django MyShop", recipient_list=[self.email],
+                             commit=commit)
 
     def get_absolute_url(self):
         return reverse('orders:detail', kwargs={"pk": self.pk})
@@ -118,6 +126,7 @@ class OrderProducts(models.Model):
     amount = models.PositiveIntegerField(default=1)
     product_name = models.CharField(max_length=100, default='', blank=True)
     product_price = models.DecimalField(default=0, blank=True, max_digits=10, decimal_places=2)
+    stripe_price_id = models.CharField(max_length=220, null=True, blank=True)
 
     class Meta:
         verbose_name_plural = "OrderProducts"
@@ -135,3 +144,33 @@ class OrderProducts(models.Model):
 
     def __str__(self):
         return f"Order:{self.order.id}-{self.product_name}"
+
+
+class StripeEvent(models.Model):
+    # Raw Stripe webhook event. Saved by stripe_webhook view and applied by process_stripe_events command.
+    # Unique event_id makes Stripe retries of the same event no-ops.
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    # Event creation time in Stripe, events are applied in this order.
+    created = models.DateTimeField()
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    # Failed attempts of applying event, event is skipped after STRIPE_EVENT_MAX_ATTEMPTS failures.
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed', 'created'], name='stripe_event_processed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id}-{self.type}"
+
+    @classmethod
+    def save_event(cls, event):
+        # Save event received by webhook with one insert, already received events are ignored.
+        cls.objects.bulk_create([cls(event_id=event['id'], type=event['type'], payload=event,
+                                     created=datetime.fromtimestamp(event['created'], tz=timezone.utc))],
+                                ignore_conflicts=True)
@@ -0,0 +1,32 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from .models import OrderProducts
+
+# Order placement. Order and all its products are saved in one transaction, so failure never leaves partial order.
+
+
+def get_current_stripe_price_id(product_specific):
+    # Returns Stripe price id of product specific or None if its price changed since last synchronization.
+    if product_specific.stripe_price_amount != product_specific.stripe_unit_amount:
+        return None
+    return product_specific.stripe_price_id
+
+
+def place_order(order, cart_lines):
+    # Save order with products from cart_lines - list of tuples (ProductSpecific object, amount) with Product
+    # objects already loaded. Current product names and prices are saved in OrderProducts, all rows are inserted
+    # with a single query. Stripe price is saved only if it was synchronized with current price. Returns saved order.
+    content_types = ContentType.objects.get_for_models(*{type(product_specific) for product_specific, _ in cart_lines})
+    order.total_items = sum(amount for _, amount in cart_lines)
+    order.total_value = sum(amount * product_specific.product.current_price for product_specific, amount in cart_lines)
+    with transaction.atomic():
+        order.save()
+        order_products = [
+            OrderProducts(order=order, content_type=content_types[type(product_specific)],
+                          object_id=product_specific.id, amount=amount, product_name=str(product_specific),
+                          product_price=product_specific.product.current_price,
+                          stripe_price_id=get_current_stripe_price_id(product_specific))
+            for product_specific, amount in cart_lines
+        ]
+        OrderProducts.objects.bulk_create(order_products)
+    return order
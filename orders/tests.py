@@ -1,3 +1,196 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+import stripe
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import urlsafe_base64_encode
+from mailing.models import OutgoingEmail
+from products.models import Producer, Product, ProductShoe, Color
+from .checkout import create_checkout_session, get_line_items, CheckoutUnavailable, CheckoutFailed, CircuitBreaker, \
+    http_client
+from .forms import OrderForm
+from .models import Order, OrderProducts, StripeEvent
+from .placement import place_order
+from .token_generator import order_confirmation_token_generator
+from .webhooks import process_events
 
 # Create your tests here.
+
+
+def create_order(**kwargs):
+    data = {'email': 'user@example.com', 'first_name': 'First', 'last_name': 'Last', 'state': 'State', 'city': 'City',
+            'street': 'Street', 'number': '1', 'postal_code': '00-000', 'confirmed': True}
+    return Order.objects.create(**{**data, **kwargs})
+
+
+class OrderFormTest(TestCase):
+
+    def test_form_contains_only_customer_fields(self):
+        self.assertEqual(list(OrderForm().fields),
+                         ['email', 'first_name', 'last_name', 'state', 'city', 'street', 'number', 'postal_code'])
+
+
+class PlaceOrderTest(TestCase):
+
+    def test_only_synchronized_stripe_prices_are_saved(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        color = Color.objects.create(name='red')
+        synced = ProductShoe.objects.create(product=product, available=True, size=40, color=color,
+                                            stripe_price_id='price_1', stripe_price_amount=10000)
+        # Price of product changed, new Stripe price is not created yet.
+        outdated = ProductShoe.objects.create(product=product, available=True, size=41, color=color,
+                                              stripe_price_id='price_2', stripe_price_amount=12000)
+        not_synced = ProductShoe.objects.create(product=product, available=True, size=42, color=color)
+        order = place_order(Order(email='user@example.com', first_name='First', last_name='Last', state='State',
+                                  city='City', street='Street', number='1', postal_code='00-000'),
+                            [(synced, 1), (outdated, 2), (not_synced, 1)])
+        self.assertEqual((order.total_items, order.total_value), (4, 400))
+        self.assertEqual(list(order.order_products.order_by('id').values_list('stripe_price_id', flat=True)),
+                         ['price_1', None, None])
+
+
+class CheckoutTest(TestCase):
+
+    def setUp(self):
+        self.order = create_order()
+        content_type = ContentType.objects.get_for_model(Order)
+        OrderProducts.objects.bulk_create([
+            OrderProducts(order=self.order, content_type=content_type, object_id=1, amount=2, product_name='Shoe 40',
+                          product_price=Decimal('99.99'), stripe_price_id=None),
+            OrderProducts(order=self.order, content_type=content_type, object_id=2, amount=1, product_name='Shoe 41',
+                          product_price=Decimal('120.00'), stripe_price_id='price_1'),
+        ])
+        patcher = mock.patch('orders.checkout.circuit_breaker', CircuitBreaker(3, 30))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_session(self, side_effect):
+        with mock.patch('orders.checkout.create_stripe_checkout_session', side_effect=side_effect) as create:
+            return create_checkout_session(self.order, 'https://shop/success', 'https://shop/cancel'), create
+
+    def test_line_items_use_prices_saved_in_order(self):
+        self.assertEqual(get_line_items(self.order), [
+            {'price_data': {'currency': 'pln', 'unit_amount': 9999, 'product_data': {'name': 'Shoe 40'}},
+             'quantity': 2},
+            {'price': 'price_1', 'quantity': 1},
+        ])
+
+    def test_checkout_session_is_saved(self):
+        session = stripe.checkout.Session.construct_from({'id': 'cs_1', 'url': 'https://checkout/cs_1'}, 'sk_test')
+        url, create = self.create_session([session])
+        self.assertEqual(url, 'https://checkout/cs_1')
+        self.assertIs(create.call_args.args[0], http_client)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.stripe_checkout_id, self.order.checkout_pending), ('cs_1', False))
+
+    def test_unavailable_stripe_is_retried_later(self):
+        with self.assertRaises(CheckoutUnavailable):
+            self.create_session(stripe.error.APIConnectionError("Request timed out."))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.checkout_error, '')
+
+    def test_rejected_checkout_is_not_retried(self):
+        Order.objects.filter(id=self.order.id).update(checkout_pending=True)
+        with self.assertRaises(CheckoutFailed):
+            self.create_session(stripe.error.InvalidRequestError("No such price.", 'line_items'))
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.checkout_pending)
+        self.assertEqual(self.order.checkout_error, "No such price.")
+
+    def test_global_stripe_client_is_not_changed(self):
+        self.assertIsNot(stripe.default_http_client, http_client)
+
+
+class PaymentLinksTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('orders.checkout.circuit_breaker', CircuitBreaker(3, 30))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_order(self, **kwargs):
+        order = create_order(**kwargs)
+        OrderProducts.objects.create(order=order, content_type=ContentType.objects.get_for_model(Order), object_id=1,
+                                     product_name='Shoe 40', product_price=Decimal('100.00'))
+        return order
+
+    def send_payment_links(self, side_effect):
+        stderr = StringIO()
+        with mock.patch('orders.checkout.create_stripe_checkout_session', side_effect=side_effect) as create:
+            call_command('send_payment_links', stdout=StringIO(), stderr=stderr)
+        return create, stderr.getvalue()
+
+    def test_confirmed_order_gets_payment_link_from_worker(self):
+        order = self.create_order(confirmed=False)
+        url = reverse('orders:confirm', kwargs={'oidb64': urlsafe_base64_encode(str(order.id).encode()),
+                                                'token': order_confirmation_token_generator.make_token(order)})
+        with mock.patch('orders.checkout.create_stripe_checkout_session') as create:
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse('pages:home'), fetch_redirect_response=False)
+        # Stripe is not called in request.
+        create.assert_not_called()
+        order.refresh_from_db()
+        self.assertTrue(order.checkout_pending)
+        session = stripe.checkout.Session.construct_from({'id': 'cs_1', 'url': 'https://checkout/cs_1'}, 'sk_test')
+        self.send_payment_links([session])
+        order.refresh_from_db()
+        self.assertEqual((order.checkout_pending, order.stripe_checkout_id), (False, 'cs_1'))
+        self.assertTrue(OutgoingEmail.objects.filter(subject=f"Payment link for order nr: {order.id}",
+                                                     message__contains='https://checkout/cs_1').exists())
+
+    def test_orders_are_retried_when_stripe_is_unavailable(self):
+        orders = [self.create_order(checkout_pending=True) for _ in range(2)]
+        create, stderr = self.send_payment_links(stripe.error.APIConnectionError("Request timed out."))
+        # Remaining orders are not tried when Stripe is unavailable.
+        self.assertEqual(create.call_count, 1)
+        self.assertIn("Request timed out.", stderr)
+        self.assertEqual(Order.objects.filter(id__in=[order.id for order in orders], checkout_pending=True).count(), 2)
+
+
+@override_settings(STRIPE_EVENT_MAX_ATTEMPTS=2)
+class StripeEventsTest(TestCase):
+
+    def save_event(self, event_id, checkout_id, created=1700000000, email='user@example.com'):
+        StripeEvent.save_event({'id': event_id, 'type': 'checkout.session.completed', 'created': created,
+                                'data': {'object': {'id': checkout_id, 'customer_email': email}}})
+
+    def test_checkout_completed_marks_order_paid_once(self):
+        order = create_order(stripe_checkout_id='cs_1')
+        self.save_event('evt_1', 'cs_1')
+        self.assertEqual(process_events(), (1, 0, 1))
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.WAIT_SENDING)
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+        # Replayed event doesn't change order again.
+        self.save_event('evt_2', 'cs_1')
+        self.assertEqual(process_events(), (1, 0, 0))
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def test_order_with_other_status_is_not_changed(self):
+        order = create_order(stripe_checkout_id='cs_1', status=Order.SENT)
+        self.save_event('evt_1', 'cs_1')
+        self.assertEqual(process_events(), (1, 0, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.SENT)
+
+    def test_failed_event_does_not_block_other_events(self):
+        first = create_order(stripe_checkout_id='cs_1')
+        second = create_order(stripe_checkout_id='cs_2')
+        self.save_event('evt_1', 'cs_1', created=1700000000)
+        StripeEvent.save_event({'id': 'evt_bad', 'type': 'checkout.session.completed', 'created': 1700000001})
+        self.save_event('evt_2', 'cs_2', created=1700000002)
+        self.assertEqual(process_events(), (2, 1, 2))
+        for order in [first, second]:
+            order.refresh_from_db()
+            self.assertEqual(order.status, Order.WAIT_SENDING)
+        event = StripeEvent.objects.get(event_id='evt_bad')
+        self.assertEqual((event.processed, event.attempts), (None, 1))
+        self.assertEqual(event.last_error, "KeyError: 'data'")
+        # Failed event is retried until maximum number of attempts is reached, then it is skipped.
+        self.assertEqual(process_events(), (0, 1, 0))
+        self.assertEqual(process_events(), (0, 0, 0))
+        self.assertEqual(StripeEvent.objects.get(event_id='evt_bad').attempts, 2)
@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect, reverse, get_object_or_404, HttpResponse
 from products import cart
-from .models import Order, OrderProducts
+from .models import Order, StripeEvent
+from .placement import place_order
 from django.contrib import messages
 from .forms import OrderForm
 from django.conf import settings
@@ -14,6 +15,7 @@ from .token_generator import order_confirmation_token_generator
 from django.http import HttpResponseNotFound
 from django.utils import timezone
 import stripe
+import json
 from django.views.decorators.csrf import csrf_exempt
 # Create your views here.
 
@@ -22,36 +24,12 @@ UserData = apps.get_model('users', 'UserData')
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
-def create_checkout(request, order_object_id):
-    try:
-        order = Order.objects.get(id=order_object_id)
-    except (ValueError, ObjectDoesNotExist):
-        return None
-    # Create stripe checkout session if order is confirmed.
+def request_checkout(request, order):
+    # Checkout session of confirmed order is created and its link is emailed by send_payment_links command, so Stripe
+    # is not called in request.
     if order.confirmed:
-        line_items = []
-        for product in order.order_products.all():
-            if product.product_specific.stripe_price_id is not None:
-                line_items.append(
-                    {
-                        'price': product.product_specific.stripe_price_id,
-                        'quantity': product.amount
-                    }
-                )
-        success_url = request.build_absolute_uri(reverse('orders:checkout_success'))
-        cancel_url = request.build_absolute_uri(reverse('orders:checkout_cancelled'))
-        if line_items:
-            stripe_checkout_session = stripe.checkout.Session.create(
-                line_items=line_items,
-                mode="payment",
-                success_url=success_url,
-                cancel_url=cancel_url,
-                customer_email=order.email,
-            )
-            order.stripe_checkout_id = stripe_checkout_session.stripe_id
-            order.save()
-            return stripe_checkout_session.url
-    return None
+        order.checkout_pending = True
+        messages.info(request, "Payment link will be emailed to you shortly.")
 
 
 def order_data_view(request):
@@ -94,20 +72,15 @@ def order_data_view(request):
             if user_object is not None:
                 order_object.user = user_object
                 order_object.confirmed = True
-            order_object.save()
-            # Create order products, not using bulk_create to call save method
-            for product, amount in products:
-                order_product = OrderProducts(order=order_object, product_specific=product, amount=amount)
-                order_product.save(create=True)
-            checkout_session_url = create_checkout(request, order_object.id)
-            order_object.send_to_user(request,  checkout_session_url)
+            request_checkout(request, order_object)
+            # Save order with products in one transaction.
+            place_order(order_object, products)
+            order_object.send_to_user(request)
             messages.success(request, f"Your order number {order_object.id} has been created.")
             cart.clear_cart(request)
-            if checkout_session_url is not None:
-                return redirect(checkout_session_url)
-            else:
+            if not order_object.confirmed:
                 messages.warning(request, "Confirm your order to checkout.")
-                return redirect('pages:home')
+            return redirect('pages:home')
         else:
             messages.warning(request, "Wrong data inserted.")
     context = {
@@ -148,11 +121,9 @@ def order_confirm_view(request, oidb64, token):
     # Check provided token.
     elif order_confirmation_token_generator.check_token(order, token):
         order.confirmed = True
+        request_checkout(request, order)
         order.save()
-        checkout_session_url = create_checkout(request, order_id)
-        order.send_confirmation_ok_email(checkout_session_url)
-        if checkout_session_url is not None:
-            return redirect(checkout_session_url)
+        order.send_confirmation_ok_email()
     else:
         return HttpResponse('401 Unauthorized. Token error.', status=401)
     return redirect('pages:home')
@@ -181,19 +152,8 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError as e:
         # Invalid signature
         return HttpResponse(status=400)
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        data_object = event['data']['object']
-        email = data_object.get('customer_email')
-        checkout_id = data_object.get('id')
-        try:
-            order_object = Order.objects.get(email=email, stripe_checkout_id=checkout_id)
-        except ObjectDoesNotExist:
-            # No object found.
-            return HttpResponse(status=400)
-        # Change order status and send email confirmation to user.
-        order_object.status = order_object.WAIT_SENDING
-        order_object.save()
-        order_object.send_payment_ok_email()
+    # Event is only saved here and applied later by process_stripe_events command, so Stripe gets response
+    # immediately.
+    StripeEvent.save_event(json.loads(payload))
     return HttpResponse(status=200)
 
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from mailing.models import OutgoingEmail
+from .models import Order, StripeEvent
+
+# Processing of Stripe webhook events saved by stripe_webhook view. Events are applied in batches in order of their
+# creation in Stripe. Orders are looked up with one query per batch and notifications go through email outbox.
+# Event which can't be applied doesn't block the others, its error is saved and it is retried in next batches.
+
+
+def apply_checkout_completed(events):
+    # Mark orders paid by checkout sessions from events. Returns number of updated orders.
+    # {checkout id: set of customer emails}
+    sessions = {}
+    for event in events:
+        data_object = event.payload['data']['object']
+        sessions.setdefault(data_object.get('id'), set()).add(data_object.get('customer_email'))
+    # Orders are locked, so status can't be changed by others before update.
+    orders = Order.objects.select_for_update().filter(
+        stripe_checkout_id__in=[checkout_id for checkout_id in sessions if checkout_id], status=Order.WAIT_PAYMENT)
+    # Replayed events of already paid orders are skipped by status filter.
+    paid = [order for order in orders if order.email in sessions[order.stripe_checkout_id]]
+    if not paid:
+        return 0
+    Order.objects.filter(id__in=[order.id for order in paid], status=Order.WAIT_PAYMENT).update(
+        status=Order.WAIT_SENDING, modified=timezone.now())
+    OutgoingEmail.objects.bulk_create([order.send_payment_ok_email(commit=False) for order in paid])
+    return len(paid)
+
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': apply_checkout_completed,
+}
+
+
+def apply_events(handler, events):
+    # Apply events with handler in savepoint. If it fails, events are applied one by one, each in its own savepoint.
+    # Returns tuple (number of updated orders, list of failed events with recorded error).
+    if len(events) > 1:
+        try:
+            with transaction.atomic():
+                return handler(events), []
+        except Exception:
+            pass
+    updated = 0
+    failed = []
+    for event in events:
+        try:
+            with transaction.atomic():
+                updated += handler([event])
+        except Exception as error:
+            event.attempts += 1
+            event.last_error = f"{type(error).__name__}: {error}"
+            failed.append(event)
+    return updated, failed
+
+
+def process_events(batch_size=100):
+    # Apply batch of unprocessed events. Returns tuple (processed events, failed events, updated orders).
+    with transaction.atomic():
+        events = list(StripeEvent.objects.select_for_update(skip_locked=True)
+                      .filter(processed=None, attempts__lt=settings.STRIPE_EVENT_MAX_ATTEMPTS)
+                      .order_by('created', 'id')[:batch_size])
+        if not events:
+            return 0, 0, 0
+        updated = 0
+        failed = []
+        by_type = {}
+        for event in events:
+            by_type.setdefault(event.type, []).append(event)
+        for event_type, handler in EVENT_HANDLERS.items():
+            if event_type in by_type:
+                type_updated, type_failed = apply_events(handler, by_type[event_type])
+                updated += type_updated
+                failed += type_failed
+        if failed:
+            StripeEvent.objects.bulk_update(failed, ['attempts', 'last_error'])
+        # Events without handler are marked as processed too.
+        failed_ids = {event.id for event in failed}
+        StripeEvent.objects.filter(id__in=[event.id for event in events if event.id not in failed_ids]) \
+            .update(processed=timezone.now())
+    return len(events) - len(failed), len(failed), updated
@@ -1,13 +1,16 @@
 from django.shortcuts import render
 from django.apps import apps
+from products.card_cache import render_product_cards
+from products.page_cache import cache_anonymous_page, HOME_TAG
 # Create your views here.
 
 
+@cache_anonymous_page(lambda request: [HOME_TAG])
 def home_view(request):
     Product = apps.get_model('products', 'Product')
     # Get 9 promoted products in random order to display on home page.
     products = Product.objects.filter(promoted=True).order_by("?")[:9]
-    context = {'products': products}
+    context = {'cards': render_product_cards(products)}
     return render(request, 'pages/home.html', context)
 
 
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import Product, ProductShoe, Producer, Color, ProductSuit, ProductShirt,\
-    ProductImage, ProductMainImage, Rating, ProductBackpack
+    ProductImage, ProductMainImage, Rating, ProductBackpack, Cart, StripeSyncIntent, \
+    StripePrice
 from django.forms import ModelForm
 from django.db.models import ObjectDoesNotExist
 
@@ -8,14 +9,18 @@ from django.db.models import ObjectDoesNotExist
 admin.site.register(Producer)
 admin.site.register(Color)
 admin.site.register(Rating)
+admin.site.register(Cart)
+admin.site.register(StripeSyncIntent)
+admin.site.register(StripePrice)
 
 
 class ProductImageAdmin(admin.ModelAdmin):
     exclude = ('thumbnail',)
+    readonly_fields = ('width', 'height', 'processed')
 
 
 class ProductAdmin(admin.ModelAdmin):
-    readonly_fields = ('avg_rating',)
+    readonly_fields = Product.RATING_AGGREGATE_FIELDS
 
 
 class ProductSpecificAdmin(admin.ModelAdmin):
@@ -25,7 +30,7 @@ class ProductSpecificAdmin(admin.ModelAdmin):
             kwargs["queryset"] = Product.objects.filter(type=self.model.TYPE)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
-    readonly_fields = ('stripe_product_id', 'stripe_price_id')
+    readonly_fields = ('stripe_product_id', 'stripe_price_id', 'stripe_price_amount')
 
 
 # Filter ProductImages only referring to set Product.
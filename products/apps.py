@@ -5,7 +5,10 @@ class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
     def ready(self):
+        from .registry import build_registry
+        build_registry()
         import products.signals
+        import products.checks
 
 
 
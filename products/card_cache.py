@@ -0,0 +1,66 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import ProductImage
+
+# Cache of rendered product cards shared by home and category pages. Card of a product is stored together with
+# version of the product, which is changed when product, its images or ratings change. Versions and cards of all
+# products on a page are read with one get_many call, only missing or outdated cards are rendered and stored with
+# one set_many call.
+
+
+def get_version_key(product_id):
+    return f"product_card_version_{product_id}"
+
+
+def get_card_key(product_id):
+    return f"product_card_{product_id}"
+
+
+def invalidate_product_card(product_id):
+    # Expired version is created again with new value, so cards stored with old version are not used.
+    cache.set(get_version_key(product_id), time.time_ns(), timeout=settings.PRODUCT_CARD_CACHE_TIMEOUT)
+
+
+def load_card_data(products):
+    # Load main image and first image of products with fixed number of queries.
+    first_image = Prefetch('images', queryset=ProductImage.objects.order_by('id')[:1], to_attr='first_images')
+    prefetch_related_objects(products, 'main_img__main_img', first_image)
+
+
+def render_product_cards(products):
+    # Returns list of rendered cards of products. Images of products are loaded only for cards not found in cache.
+    products = list(products)
+    keys = [key for product in products for key in (get_version_key(product.id), get_card_key(product.id))]
+    cached = cache.get_many(keys)
+    # Missing versions are created before rendering and only added, so version set in the meantime by
+    # invalidate_product_card is not overwritten.
+    for product in products:
+        version_key = get_version_key(product.id)
+        if version_key not in cached:
+            version = time.time_ns()
+            if not cache.add(version_key, version, timeout=settings.PRODUCT_CARD_CACHE_TIMEOUT):
+                version = cache.get(version_key, version)
+            cached[version_key] = version
+    cards = {}
+    missing = []
+    new_entries = {}
+    for product in products:
+        version = cached[get_version_key(product.id)]
+        card_version, card = cached.get(get_card_key(product.id), (None, None))
+        if card_version == version:
+            cards[product.id] = card
+        else:
+            missing.append((product, version))
+    if missing:
+        load_card_data([product for product, _ in missing])
+    for product, version in missing:
+        card = render_to_string('products/product_card.html', {'product': product})
+        cards[product.id] = card
+        new_entries[get_card_key(product.id)] = (version, card)
+    if new_entries:
+        cache.set_many(new_entries, timeout=settings.PRODUCT_CARD_CACHE_TIMEOUT)
+    return [mark_safe(cards[product.id]) for product in products]
@@ -1,8 +1,9 @@
 from django.contrib import messages
 from django.shortcuts import redirect
-from .models import ProductSpecific, Product
+from .models import ProductSpecific, Product, get_product_specific_model
+from .cart_store import load_cart, save_cart
 
-# Cart is implemented by adding 'cart' key to session containing a dict.
+# Cart is a dict stored by cart_store module, keyed by user or anonymous session.
 # This dict contains keys formatted as full_id:"<Product.id>_<ProductSpecific.id>" and values are amounts of
 # these products currently in the cart.
 
@@ -13,21 +14,20 @@ def add_to_cart(request, product_specific):
     if not product_specific or not isinstance(product_specific, ProductSpecific):
         messages.warning(request, 'Wrong product specified.')
     else:
-        current_cart = request.session.get('cart', {})
+        current_cart = get_current_cart(request)
         # get identification of product specific "Product.id"_"ProductSpecific.id"
         full_id = product_specific.get_full_id()
         # increase amount of product_specific or add new key
         current_cart[full_id] = current_cart.get(full_id, 0) + 1
-        # update cart and cart length in session
-        request.session['cart'] = current_cart
-        request.session['cart_length'] = request.session.get('cart_length', 0) + 1
+        # save updated cart
+        save_cart(request, current_cart)
         messages.success(request, f'Product {product_specific} added to cart.')
     return redirect(request.path)
 
 
 def remove_from_cart(request, product_specific):
     # Remove product_specific object from cart.
-    current_cart = request.session.get('cart', {})
+    current_cart = get_current_cart(request)
     if not product_specific or not isinstance(product_specific, ProductSpecific):
         messages.warning(request, 'Wrong product specified.')
         return redirect(request.path)
@@ -40,63 +40,90 @@ def remove_from_cart(request, product_specific):
         # if amount is less than equal zero remove the product_specific key form cart dict
         if current_cart[full_id] <= 0:
             del current_cart[full_id]
-        # update session
-        request.session['cart'] = current_cart
-        request.session['cart_length'] = request.session.get('cart_length', 0) - 1
+        # save updated cart
+        save_cart(request, current_cart)
         messages.success(request, f'Product {product_specific} removed from cart.')
     return redirect(request.path)
 
 
-def get_cart_products_specific_list(request):
-    # Function returns ProductsSpecific objects in cart as a list of tuples
-    # containing ProductSpecific object and amount of this object.
-    current_cart = get_current_cart(request)
-    products = []
-    for full_id, amount in current_cart.items():
+def parse_cart_key(full_id):
+    # Returns tuple (Product.id, ProductSpecific.id) from full_id or None if full_id is incorrect.
+    try:
         product_id, product_specific_id = full_id.split('_')
-        product_specific = Product.get_product_specific(product_id, product_specific_id)
-        products.append((product_specific, amount))
-    return products
+        return int(product_id), int(product_specific_id)
+    except ValueError:
+        return None
+
 
-def get_cart_status(request):
-    # calculate total amount of items in cart and value of those items
+def resolve_cart(request):
+    # Load all ProductSpecific objects in cart with their Products at once - one query for product types and one
+    # query for each product type in cart. Returns list of tuples (ProductSpecific object, amount), total amount of
+    # items and total value of the cart. Keys referencing objects that no longer exist are removed from the cart.
+    current_cart = get_current_cart(request)
+    parsed = {}
+    for full_id in current_cart.keys():
+        ids = parse_cart_key(full_id)
+        if ids is not None:
+            parsed[full_id] = ids
+    product_types = dict(Product.objects.filter(id__in={product_id for product_id, _ in parsed.values()})
+                         .values_list('id', 'type'))
+    # Group ProductSpecific ids by their model.
+    grouped = {}
+    for product_id, product_specific_id in parsed.values():
+        model = get_product_specific_model(product_types.get(product_id))
+        if model is not None:
+            grouped.setdefault(model, set()).add(product_specific_id)
+    loaded = {}
+    for model, ids in grouped.items():
+        for product_specific in model.objects.filter(id__in=ids).select_related('product', 'color'):
+            loaded[(product_specific.product_id, product_specific.id)] = product_specific
+    lines = []
     total_amount = 0
     total_value = 0
-    # get current cart dictionary from user session
-    current_cart = get_current_cart(request)
+    invalid_keys = []
     for full_id, amount in current_cart.items():
-        # split full_id into product and product_specific_ids
-        product_id, product_specific_id = full_id.split('_')
-        product_specific = Product.get_product_specific(product_id, product_specific_id)
+        product_specific = loaded.get(parsed.get(full_id))
+        if product_specific is None:
+            invalid_keys.append(full_id)
+            continue
+        lines.append((product_specific, amount))
         total_amount += amount
-        total_value += amount*product_specific.product.current_price
-    # update cart_length session object
-    request.session['cart_length'] = total_amount
-    request.session['cart_value'] = str(total_value)
-    return total_amount, total_value
+        total_value += amount * product_specific.product.current_price
+    if invalid_keys:
+        for full_id in invalid_keys:
+            del current_cart[full_id]
+        save_cart(request, current_cart)
+    return lines, total_amount, total_value
+
+
+def get_cart_products_specific_list(request):
+    # Function returns ProductsSpecific objects in cart as a list of tuples
+    # containing ProductSpecific object and amount of this object.
+    lines, _, _ = resolve_cart(request)
+    return lines
+
+
+def get_cart_length(request):
+    # Total amount of items in cart, calculated without database queries when cart is cached.
+    return sum(get_current_cart(request).values())
 
 
 def clear_cart(request):
-    # delete all cart information from user session
-    if 'cart' in request.session:
-        del request.session['cart']
-    if 'cart_length' in request.session:
-        del request.session['cart_length']
-    if 'cart_value' in request.session:
-        del request.session['cart_value']
+    # delete all cart information
+    save_cart(request, {})
+    # remove cart data stored in session by previous versions
+    for key in ['cart', 'cart_length', 'cart_value']:
+        if key in request.session:
+            del request.session[key]
 
 
 def get_current_cart(request):
     # function to get current cart status and check if it contains correct values and remove incorrect keys
-    current_cart = {}
-    check_cart = request.session.get('cart', {})
-    if not isinstance(check_cart, dict):
-        return current_cart
+    current_cart = load_cart(request)
     delete_keys = []
-    for key in check_cart.keys():
+    for key in current_cart.keys():
         if not isinstance(key, str) or '_' not in key:
             delete_keys.append(key)
     for key in delete_keys:
-        del check_cart[key]
-    current_cart = check_cart
+        del current_cart[key]
     return current_cart
@@ -0,0 +1,122 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from .models import Cart
+
+# Cart storage with cache in front of database table. Cart content is loaded once per request and written only
+# when it has changed, so read only page views don't write to session or database.
+
+
+def get_cart_key(request, create=False):
+    # Returns key of the cart - user id for logged-in users or random cart id stored in session for anonymous users.
+    # Cart id is kept in session when session key changes after login. Returns None if anonymous user has no cart
+    # and create is False.
+    if request.user.is_authenticated:
+        return f"user_{request.user.id}"
+    cart_id = request.session.get('cart_id')
+    if cart_id is None:
+        if not create:
+            return None
+        cart_id = uuid.uuid4().hex
+        request.session['cart_id'] = cart_id
+    return f"session_{cart_id}"
+
+
+def get_cache_key(cart_key):
+    return f"cart_{cart_key}"
+
+
+def serialize_cart(cart):
+    return ','.join(f"{full_id}:{amount}" for full_id, amount in cart.items())
+
+
+def deserialize_cart(content):
+    cart = {}
+    for item in content.split(','):
+        full_id, _, amount = item.partition(':')
+        try:
+            amount = int(amount)
+        except ValueError:
+            continue
+        if full_id and amount > 0:
+            cart[full_id] = amount
+    return cart
+
+
+def load_content(cart_key):
+    # Get serialized cart content from cache or database.
+    content = cache.get(get_cache_key(cart_key))
+    if content is None:
+        content = Cart.objects.filter(key=cart_key).values_list('content', flat=True).first() or ''
+        cache.set(get_cache_key(cart_key), content, settings.CART_CACHE_TIMEOUT)
+    return content
+
+
+def migrate_session_cart(request):
+    # Move cart stored in session by previous versions to cart store.
+    session_cart = request.session.pop('cart', None)
+    for key in ['cart_length', 'cart_value']:
+        request.session.pop(key, None)
+    if not isinstance(session_cart, dict) or not session_cart:
+        return
+    cart_key = get_cart_key(request, create=True)
+    cart = deserialize_cart(load_content(cart_key))
+    for full_id, amount in session_cart.items():
+        if isinstance(full_id, str) and isinstance(amount, int) and amount > 0:
+            cart[full_id] = cart.get(full_id, 0) + amount
+    write_content(cart_key, serialize_cart(cart))
+    request._cart_content = None
+
+
+def load_cart(request):
+    # Returns copy of current cart dictionary. Content is loaded only once per request.
+    if 'cart' in request.session:
+        migrate_session_cart(request)
+    cart_key = get_cart_key(request)
+    if cart_key is None:
+        return {}
+    loaded = getattr(request, '_cart_content', None)
+    if loaded is None or loaded[0] != cart_key:
+        loaded = (cart_key, load_content(cart_key))
+        request._cart_content = loaded
+    return deserialize_cart(loaded[1])
+
+
+def write_content(cart_key, content):
+    if content:
+        Cart.objects.update_or_create(key=cart_key, defaults={'content': content})
+    else:
+        Cart.objects.filter(key=cart_key).delete()
+    cache.set(get_cache_key(cart_key), content, settings.CART_CACHE_TIMEOUT)
+
+
+def save_cart(request, cart):
+    # Save cart only if its content has changed.
+    content = serialize_cart(cart)
+    cart_key = get_cart_key(request, create=bool(content))
+    if cart_key is None:
+        return
+    loaded = getattr(request, '_cart_content', None)
+    if loaded is None or loaded[0] != cart_key:
+        loaded = (cart_key, load_content(cart_key))
+    if loaded[1] == content:
+        return
+    write_content(cart_key, content)
+    request._cart_content = (cart_key, content)
+
+
+def merge_session_cart(request, user):
+    # Move anonymous cart to the cart of user who has just logged in.
+    cart_id = request.session.pop('cart_id', None)
+    if cart_id is None:
+        return
+    session_key = f"session_{cart_id}"
+    session_cart = deserialize_cart(load_content(session_key))
+    if session_cart:
+        user_key = f"user_{user.id}"
+        user_cart = deserialize_cart(load_content(user_key))
+        for full_id, amount in session_cart.items():
+            user_cart[full_id] = user_cart.get(full_id, 0) + amount
+        write_content(user_key, serialize_cart(user_cart))
+        write_content(session_key, '')
+    request._cart_content = None
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Caches kept in memory of one process. Invalidations made by other processes never reach them.
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # Variant indexes, carts, pages and product cards are invalidated through cache by other processes.
+    if settings.DEBUG:
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHE_BACKENDS:
+        return [Error(f"Default cache backend {backend} is not shared between processes.",
+                      hint="Use Redis, memcached or database cache backend.", id='products.E001')]
+    return []
@@ -0,0 +1,99 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from .models import Product, ProductImage, Rating
+from .pagination import keyset_paginate
+from .variant_index import get_lookup_field
+
+# Loading of data displayed on product detail page in a fixed number of queries:
+# 1. product with producer and main image,
+# 2. all images of product,
+# 3. all available variants of product with attribute values,
+# 4. first page of comments with users.
+
+COMMENTS_ORDERING = {
+    '1': ('-created', '-id'),  # newest
+    '2': ('created', 'id'),  # oldest
+    '3': ('-value', '-id'),  # highest value
+    '4': ('value', 'id'),   # lowest value
+}
+COMMENTS_PAGE_SIZE = 10
+
+
+def get_comments_page(product_id, query_dict):
+    # Returns page of product comments ordered by order parameter in query dict (default from the newest to oldest)
+    # following cursor from query dict and cursor of next page.
+    ordering = COMMENTS_ORDERING.get(query_dict.get('order', '1'), COMMENTS_ORDERING['1'])
+    comments = Rating.objects.filter(product_id=product_id, has_comment=True).select_related('user')
+    return keyset_paginate(comments, ordering, query_dict.get('cursor'), page_size=COMMENTS_PAGE_SIZE)
+
+
+def get_selections(model, query_dict):
+    # Returns list of sets of values selected for each attribute (empty set - no selection) or None if some value is
+    # incorrect.
+    selections = []
+    for lookup in model.attribute_lookups:
+        field = get_lookup_field(model, lookup)
+        try:
+            selections.append({field.to_python(value) for value in query_dict.getlist(lookup, []) if value})
+        except (ValidationError, ValueError):
+            # Wrong filtering parameters - no variant matches.
+            return None
+    return selections
+
+
+def filter_variants(model, product, query_dict):
+    # Returns list of tuples (variant id, attribute values) of available variants matching selections in query_dict.
+    lookups = model.attribute_lookups
+    selections = get_selections(model, query_dict)
+    if selections is None:
+        return []
+    rows = model.objects.filter(product=product, available=True).order_by('id').values_list('id', *lookups)
+    return [(variant_id, values) for variant_id, *values in rows
+            if all(not selected or value in selected for value, selected in zip(values, selections))]
+
+
+def get_attribute_values(model, variants):
+    # Returns dictionary {lookup: sorted list of values} of attributes of variants, same as
+    # ProductSpecific.get_attribute_values.
+    attributes = {}
+    for i, lookup in enumerate(model.attribute_lookups):
+        values = sorted({values[i] for _, values in variants if values[i] is not None})
+        if values:
+            attributes[lookup] = values
+    return attributes
+
+
+def load_product_detail(pk, query_dict):
+    # Returns dictionary with product detail page data. Raises Http404 if product doesn't exist.
+    images = Prefetch('images', queryset=ProductImage.objects.order_by('id'))
+    product = get_object_or_404(Product.objects.select_related('producer', 'main_img__main_img')
+                                .prefetch_related(images), pk=pk)
+    all_images = list(product.images.all())
+    product.first_images = all_images[:1]
+    # List of images with main image as first object.
+    main_image = product.main_image_object
+    images = None
+    if main_image is not None:
+        images = [main_image] + [image for image in all_images if image.id != main_image.id]
+    model = product.product_specific_model
+    attributes = {}
+    attribute_names = {}
+    selected_variant_id = None
+    if model is not None:
+        variants = filter_variants(model, product, query_dict)
+        attributes = get_attribute_values(model, variants)
+        attribute_names = model.get_lookup_names()
+        # Variant is selected when all attribute values are selected and only one variant matches.
+        if len(variants) == 1 and all(query_dict.get(lookup) for lookup in model.attribute_lookups):
+            selected_variant_id = variants[0][0]
+    comments, next_comments_cursor = get_comments_page(product.id, query_dict)
+    return {
+        'product': product,
+        'images': images,
+        'attributes': attributes,
+        'attribute_names': attribute_names,
+        'selected_variant_id': selected_variant_id,
+        'comments': comments,
+        'next_comments_cursor': next_comments_cursor,
+    }
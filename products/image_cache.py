@@ -0,0 +1,111 @@
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+# Disk cache of images resized on demand by resized_image_view. Files are spread over 256 shard directories named
+# by first two characters of key hash. Modification time of a file is its last access time, when size of cache
+# exceeds IMAGE_RESIZE_CACHE_MAX_SIZE least recently used files are removed by prune_image_cache command (run
+# periodically, e.g. from cron), not in requests.
+# Rendering and removing of a file is done with lock of its shard acquired (flock, works between processes), so
+# concurrent requests for the same image wait for the first one instead of resizing the same image again. Cached files
+# are returned opened, so they can still be read if they are removed later.
+
+# Access time is saved at most once per TOUCH_INTERVAL seconds to avoid write on every hit.
+TOUCH_INTERVAL = 60 * 60
+# After eviction cache is reduced to this part of maximum size.
+EVICTION_TARGET = 0.9
+
+
+class DiskCache:
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_path(self, key, extension):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}{extension}")
+
+    def open(self, path):
+        # Open file for reading and mark it as recently used. Returns None if file doesn't exist.
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - os.fstat(file.fileno()).st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                pass
+        return file
+
+    @contextmanager
+    def shard_lock(self, shard):
+        os.makedirs(shard, exist_ok=True)
+        with open(os.path.join(shard, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_create(self, key, extension, create):
+        # Returns cached file opened for reading, file is created with create(path) function on miss.
+        path = self.get_path(key, extension)
+        file = self.open(path)
+        if file is not None:
+            return file
+        with self.shard_lock(os.path.dirname(path)):
+            # File could be created while waiting for lock.
+            file = self.open(path)
+            if file is None:
+                create(path)
+                file = open(path, 'rb')
+        return file
+
+    def list_files(self):
+        # Returns list of tuples (modification time, size, path) of cached files.
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def evict(self):
+        # Remove least recently used files if cache is bigger than max_size. Returns number of removed files.
+        files = self.list_files()
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_size:
+            return 0
+        # {shard: list of paths}
+        removed_files = {}
+        for _, size, path in sorted(files):
+            if total <= self.max_size * EVICTION_TARGET:
+                break
+            removed_files.setdefault(os.path.dirname(path), []).append(path)
+            total -= size
+        for shard, paths in removed_files.items():
+            with self.shard_lock(shard):
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        return sum(len(paths) for paths in removed_files.values())
+
+
+resized_images_cache = DiskCache(settings.IMAGE_RESIZE_CACHE_DIR, settings.IMAGE_RESIZE_CACHE_MAX_SIZE)
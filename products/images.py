@@ -0,0 +1,190 @@
+import base64
+import io
+import os
+import shutil
+import uuid
+from PIL import Image, ImageFilter, ImageOps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ProductImage
+from .card_cache import invalidate_product_card
+from .page_cache import invalidate_product_pages
+
+# Processing of uploaded product images (process_images command). Renditions configured in
+# settings.IMAGE_RENDITIONS are created in every format from settings.IMAGE_RENDITION_FORMATS and published with one
+# update of ProductImage row, so pages never show partially processed image.
+
+PIL_FORMATS = {'webp': ('WEBP', '.webp'), 'jpeg': ('JPEG', '.jpg')}
+EXIF_ORIENTATION = 0x0112
+# Size of blurred placeholder displayed before image is loaded.
+PLACEHOLDER_SIZE = (16, 16)
+
+
+def write_image(image, full_path, image_format, quality):
+    # Save image file in format from IMAGE_RENDITION_FORMATS. File is written under temporary name and renamed, so it
+    # is never read partially written.
+    pil_format = PIL_FORMATS[image_format][0]
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG doesn't support transparency - use white background.
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if image.mode == 'RGBA' else None)
+        image = background
+    temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+    image.save(temp_path, format=pil_format, quality=quality)
+    os.replace(temp_path, full_path)
+
+
+def open_image(image, max_size):
+    # Prepare opened image for resizing to max_size. Returns tuple (image, original width, original height).
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    # Decode JPEG directly in reduced size if max_size is much smaller than original.
+    image.draft('RGB', (max(max_size), max(max_size)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image, width, height
+
+
+def create_placeholder(image):
+    # Returns tiny blurred version of image as data URI, which can be inlined in pages.
+    placeholder = image.copy()
+    placeholder.thumbnail(PLACEHOLDER_SIZE, Image.BILINEAR)
+    placeholder = placeholder.convert('RGB').filter(ImageFilter.GaussianBlur(1))
+    data = io.BytesIO()
+    # WebP is much smaller than JPEG for such tiny images (no large headers).
+    placeholder.save(data, format='WEBP', quality=40)
+    return f"data:image/webp;base64,{base64.b64encode(data.getvalue()).decode()}"
+
+
+def read_image_info(source_path):
+    # Returns tuple (width, height, placeholder, error) of image file. Used by backfill_placeholders command in worker
+    # processes.
+    try:
+        with Image.open(source_path) as image:
+            image, width, height = open_image(image, PLACEHOLDER_SIZE)
+            return width, height, create_placeholder(image), None
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        return None, None, '', str(error)
+
+
+def resize_image(source_path, size, full_path, image_format):
+    # Create one resized copy of image file under full_path (absolute).
+    with Image.open(source_path) as image:
+        image, _, _ = open_image(image, size)
+        image.thumbnail(size, Image.LANCZOS)
+        write_image(image, full_path, image_format, settings.IMAGE_RENDITION_FORMATS[image_format])
+
+
+def render_image(source_path, target_prefix):
+    # Create renditions of image file as "<target_prefix>_<rendition name>.<extension>" files. Doesn't use database,
+    # so it can run in worker processes. Returns tuple (width, height, placeholder, renditions).
+    with Image.open(source_path) as image:
+        largest = max(settings.IMAGE_RENDITIONS.values(), key=max)
+        image, width, height = open_image(image, largest)
+        renditions = {}
+        # Every rendition is resized from the previous, bigger one.
+        current = image
+        for name, size in sorted(settings.IMAGE_RENDITIONS.items(), key=lambda item: item[1], reverse=True):
+            current = current.copy()
+            current.thumbnail(size, Image.LANCZOS)
+            rendition = {'width': current.width, 'height': current.height}
+            for image_format, quality in settings.IMAGE_RENDITION_FORMATS.items():
+                path = f"{target_prefix}_{name}{PIL_FORMATS[image_format][1]}"
+                write_image(current, os.path.join(settings.MEDIA_ROOT, path), image_format, quality)
+                rendition[image_format] = path
+            renditions[name] = rendition
+        placeholder = create_placeholder(current)
+    return width, height, placeholder, renditions
+
+
+def import_image_file(source_path, name, target_prefix):
+    # Copy image file to MEDIA_ROOT as name and create its renditions. Used by import_images command in worker
+    # processes. Returns tuple (width, height, placeholder, renditions, error).
+    try:
+        full_path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        shutil.copyfile(source_path, full_path)
+        return *render_image(full_path, target_prefix), None
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        return None, None, '', {}, str(error)
+
+
+def get_thumbnail_path(renditions):
+    # JPEG version of smallest rendition is used as thumbnail.
+    if not renditions:
+        return ''
+    smallest = min(renditions.values(), key=lambda rendition: rendition['width'] * rendition['height'])
+    return smallest.get('jpeg', '')
+
+
+def get_rendition_files(renditions):
+    return {value for rendition in renditions.values() for key, value in rendition.items()
+            if key in settings.IMAGE_RENDITION_FORMATS}
+
+
+def get_target_prefix(image):
+    # Random part of name makes new renditions never overwrite published ones.
+    return os.path.join(os.path.dirname(image.img.name), 'renditions',
+                        f"{image.product_id}_{image.id}_{uuid.uuid4().hex[:8]}")
+
+
+def delete_files(paths):
+    for path in paths:
+        full_path = os.path.join(settings.MEDIA_ROOT, path)
+        if path and os.path.exists(full_path):
+            os.remove(full_path)
+
+
+def publish_renditions(image_id, img, width, height, placeholder, renditions):
+    # Save renditions if image wasn't changed or processed by another worker in the meantime. Files of replaced
+    # renditions are deleted. Returns True if renditions were published.
+    with transaction.atomic():
+        current = ProductImage.objects.select_for_update().filter(id=image_id, img=img, processed=None).first()
+        if current is None:
+            return False
+        old_paths = current.rendition_paths | {current.thumbnail.name}
+        thumbnail = get_thumbnail_path(renditions)
+        ProductImage.objects.filter(id=image_id).update(width=width, height=height, placeholder=placeholder,
+                                                        renditions=renditions, thumbnail=thumbnail,
+                                                        processed=timezone.now())
+        transaction.on_commit(lambda: delete_files(old_paths - get_rendition_files(renditions) - {img}))
+        # Renditions are saved without signals - pages and cards showing the image have to be refreshed.
+        product_id = current.product_id
+        transaction.on_commit(lambda: invalidate_product_pages(product_id))
+        transaction.on_commit(lambda: invalidate_product_card(product_id))
+    return True
+
+
+def process_image(image):
+    # Create and publish renditions of one image. Returns True if renditions were published.
+    width, height, placeholder, renditions = render_image(image.img.path, get_target_prefix(image))
+    if publish_renditions(image.id, image.img.name, width, height, placeholder, renditions):
+        return True
+    # Image changed during processing - created files are not used.
+    delete_files(get_rendition_files(renditions))
+    return False
+
+
+def mark_failed(image):
+    # Image which can't be processed is marked as processed without renditions, so it is not retried and pages show
+    # uploaded file.
+    ProductImage.objects.filter(id=image.id, img=image.img.name, processed=None).update(processed=timezone.now())
+
+
+def process_pending(batch_size=20, stdout=None):
+    # Process batch of images waiting for processing. Returns tuple (processed, errors).
+    images = list(ProductImage.objects.filter(processed=None).order_by('id')[:batch_size])
+    errors = 0
+    for image in images:
+        try:
+            process_image(image)
+        except (OSError, ValueError, Image.DecompressionBombError) as error:
+            errors += 1
+            mark_failed(image)
+            if stdout is not None:
+                stdout.write(f"Processing of image {image.id} failed: {error}")
+    return len(images), errors
@@ -0,0 +1,46 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand
+from products.images import read_image_info
+from products.models import ProductImage
+from products.card_cache import invalidate_product_card
+from products.page_cache import invalidate_all_pages
+
+
+class Command(BaseCommand):
+    help = "Compute dimensions and placeholders of images which don't have them, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Number of images saved in one update.")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of worker processes.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated = errors = 0
+        last_id = 0
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=django.setup) as executor:
+            while True:
+                # Images are selected by id, so images which can't be read are not selected again.
+                images = list(ProductImage.objects.filter(placeholder='', id__gt=last_id).only('id', 'img', 'product_id')
+                              .order_by('id')[:options['batch_size']])
+                if not images:
+                    break
+                last_id = images[-1].id
+                results = executor.map(read_image_info, [image.img.path for image in images], chunksize=8)
+                done = []
+                for image, (width, height, placeholder, error) in zip(images, results):
+                    if error is not None:
+                        errors += 1
+                        self.stderr.write(f"Image {image.id} can't be read: {error}")
+                        continue
+                    image.width, image.height, image.placeholder = width, height, placeholder
+                    done.append(image)
+                ProductImage.objects.bulk_update(done, ['width', 'height', 'placeholder'])
+                for product_id in {image.product_id for image in done}:
+                    invalidate_product_card(product_id)
+                updated += len(done)
+        # Placeholders are displayed on all pages with images.
+        invalidate_all_pages()
+        self.stdout.write(f"Updated {updated} images, {errors} errors in {time.perf_counter() - start:.1f} s.")
@@ -0,0 +1,15 @@
+import time
+from django.core.management.base import BaseCommand
+from products.stripe_sync import backfill_known_prices
+
+
+class Command(BaseCommand):
+    help = "Load existing Stripe prices into local price mapping, so they are reused instead of created again."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100, help="Number of prices loaded in one request.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        loaded = backfill_known_prices(options['page_size'])
+        self.stdout.write(f"Loaded {loaded} prices in {time.perf_counter() - start:.1f} s.")
@@ -0,0 +1,130 @@
+import os
+import re
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from products.card_cache import invalidate_product_card
+from products.images import import_image_file, get_thumbnail_path, get_rendition_files, delete_files
+from products.models import Product, ProductImage, ProductMainImage
+from products.page_cache import invalidate_product_pages
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+# File name is "<product id or name>.<extension>" or "<product id or name>_<number>.<extension>". Number suffix is
+# only removed when whole file name doesn't match a product, so names ending with numbers (e.g. "Air Max 90") work.
+FILE_NUMBER_PATTERN = re.compile(r'^(?P<key>.+)_\d+$')
+
+
+def get_product_keys(file_name):
+    # Returns keys of file in order of preference - whole file name and file name without number suffix.
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    keys = [stem.strip().lower()]
+    match = FILE_NUMBER_PATTERN.match(stem)
+    if match is not None:
+        keys.append(match.group('key').strip().lower())
+    return keys
+
+
+def get_product(products, file_name):
+    # Returns product found by find_products matching file or None.
+    return next((products[key] for key in get_product_keys(file_name) if key in products), None)
+
+
+def find_products(keys):
+    # Returns dictionary {key: Product} of products matching keys by id or case-insensitive name, in two queries.
+    ids = {int(key) for key in keys if key.isdigit()}
+    products = {str(product.id): product for product in Product.objects.filter(id__in=ids)}
+    names = [key for key in keys if key not in products]
+    for product in Product.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=names).order_by('id'):
+        products.setdefault(product.lower_name, product)
+    return products
+
+
+class Command(BaseCommand):
+    help = "Import product images from directory or zip file. Images are matched to products by file name " \
+           "(product id or name, optionally followed by _<number>) and processed in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Directory or zip file with images.")
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of worker processes.")
+        parser.add_argument('--set-main', action='store_true',
+                            help="Set first imported image as main image of products without main image.")
+        parser.add_argument('--description', default='', help="Description of imported images.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if zipfile.is_zipfile(path):
+            with tempfile.TemporaryDirectory() as directory:
+                with zipfile.ZipFile(path) as archive:
+                    archive.extractall(directory)
+                self.import_directory(directory, options)
+        elif os.path.isdir(path):
+            self.import_directory(path, options)
+        else:
+            raise CommandError(f"{path} is not a directory or zip file.")
+
+    def import_directory(self, directory, options):
+        start = time.perf_counter()
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(directory) for name in names
+                       if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        products = find_products({key for file in files for key in get_product_keys(file)})
+        tasks = []
+        for file in files:
+            product = get_product(products, file)
+            if product is None:
+                self.stderr.write(f"No product matching {os.path.relpath(file, directory)}.")
+                continue
+            # Files are stored under random names, so they never overwrite existing images.
+            folder = os.path.join('images', product.get_type_display())
+            token = uuid.uuid4().hex[:8]
+            name = os.path.join(folder, f"{product.id}_{token}{os.path.splitext(file)[1].lower()}")
+            tasks.append((product, file, name, os.path.join(folder, 'renditions', f"{product.id}_{token}")))
+        # Resizing is CPU bound - images are processed on all cores.
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=django.setup) as executor:
+            results = list(executor.map(import_image_file, *zip(*[task[1:] for task in tasks]),
+                                        chunksize=4) if tasks else [])
+        images = []
+        now = timezone.now()
+        for (product, file, name, _), (width, height, placeholder, renditions, error) in zip(tasks, results):
+            if error is not None:
+                self.stderr.write(f"Import of {os.path.relpath(file, directory)} failed: {error}")
+                delete_files(get_rendition_files(renditions) | {name})
+                continue
+            images.append(ProductImage(product=product, img=name, thumbnail=get_thumbnail_path(renditions),
+                                       description=options['description'], width=width, height=height,
+                                       placeholder=placeholder, renditions=renditions, processed=now))
+        with transaction.atomic():
+            ProductImage.objects.bulk_create(images, batch_size=500)
+            if options['set_main']:
+                self.set_main_images(images)
+            # Images are saved without signals - pages and cards of products have to be refreshed.
+            transaction.on_commit(lambda: self.invalidate_products({image.product for image in images}))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Imported {len(images)} of {len(files)} images in {elapsed:.1f} s "
+                          f"({len(images) / elapsed if elapsed else 0:.1f} images/s).")
+
+    def invalidate_products(self, products):
+        for product in products:
+            invalidate_product_pages(product.id, product.type)
+            invalidate_product_card(product.id)
+
+    def set_main_images(self, images):
+        # Set first imported image of every product as main image if product has no main image.
+        if images and images[0].id is None:
+            # Database doesn't return ids from bulk insert.
+            ids = dict(ProductImage.objects.filter(img__in=[image.img.name for image in images]).values_list('img', 'id'))
+            for image in images:
+                image.id = ids[image.img.name]
+        first_images = {}
+        for image in images:
+            first_images.setdefault(image.product_id, image)
+        main_images = list(ProductMainImage.objects.filter(product__in=first_images, main_img=None))
+        for main_image in main_images:
+            main_image.main_img = first_images[main_image.product_id]
+        ProductMainImage.objects.bulk_update(main_images, ['main_img'], batch_size=500)
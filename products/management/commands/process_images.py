@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from products.images import process_pending
+from products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Create renditions of uploaded product images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help="Number of images processed in one batch.")
+        parser.add_argument('--all', action='store_true',
+                            help="Process all images again e.g. after change of IMAGE_RENDITIONS setting.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking for new images.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds between checks in loop mode.")
+
+    def handle(self, *args, **options):
+        if options['all']:
+            # Published renditions are used until new ones replace them.
+            ProductImage.objects.update(processed=None)
+        while True:
+            start = time.perf_counter()
+            processed, errors = process_pending(options['batch_size'], self.stderr)
+            if processed:
+                self.stdout.write(f"Processed {processed} images, {errors} errors "
+                                  f"in {(time.perf_counter() - start)*1000:.1f} ms.")
+            if not options['loop']:
+                break
+            if processed < options['batch_size']:
+                time.sleep(options['sleep'])
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.cart_store import get_cache_key
+from products.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Remove carts of anonymous visitors not modified for CART_ANONYMOUS_MAX_AGE seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of carts removed in one query.")
+
+    def handle(self, *args, **options):
+        # Session with cart id expires when browser is closed, so old anonymous carts can't be reached anymore.
+        modified_before = timezone.now() - timedelta(seconds=settings.CART_ANONYMOUS_MAX_AGE)
+        removed = 0
+        while True:
+            carts = list(Cart.objects.filter(key__startswith='session_', modified__lt=modified_before)
+                         .values_list('id', 'key')[:options['batch_size']])
+            if not carts:
+                break
+            Cart.objects.filter(id__in=[cart_id for cart_id, _ in carts]).delete()
+            cache.delete_many([get_cache_key(key) for _, key in carts])
+            removed += len(carts)
+        self.stdout.write(f"Removed {removed} carts.")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.image_cache import resized_images_cache
+
+
+class Command(BaseCommand):
+    help = "Remove least recently used resized images if cache exceeds IMAGE_RESIZE_CACHE_MAX_SIZE."
+
+    def handle(self, *args, **options):
+        removed = resized_images_cache.evict()
+        self.stdout.write(f"Removed {removed} files.")
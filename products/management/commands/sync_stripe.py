@@ -0,0 +1,28 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.stripe_sync import sync_pending
+
+
+class Command(BaseCommand):
+    help = "Push pending product variant changes to Stripe."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of variants synchronized in one batch.")
+        parser.add_argument('--concurrency', type=int, default=settings.STRIPE_SYNC_CONCURRENCY,
+                            help="Maximum number of parallel Stripe requests.")
+        parser.add_argument('--loop', action='store_true', help="Keep checking for new changes.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds between checks in loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            processed, pushed, errors = sync_pending(options['batch_size'], options['concurrency'], self.stderr)
+            if processed:
+                self.stdout.write(f"Processed {processed} changes, {pushed} pushed to Stripe, {errors} errors "
+                                  f"in {(time.perf_counter() - start)*1000:.1f} ms.")
+            if not options['loop']:
+                break
+            # Sleep when there is nothing to do or all pushes failed.
+            if not processed or errors == pushed and pushed:
+                time.sleep(options['sleep'])
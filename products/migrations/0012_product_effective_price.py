@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+def fill_effective_price(apps, schema_editor):
+    # Calculate price after discount for existing products.
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.all())
+    for product in products:
+        product.effective_price = round(product.price * (100 - product.discount) / 100, 2)
+    Product.objects.bulk_update(products, ['effective_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_alter_productbackpack_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['type', 'effective_price'], name='product_type_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['type', 'avg_rating'], name='product_type_rating_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 16:44
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_ratings_count(apps, schema_editor):
+    # Count ratings of existing products.
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.annotate(count=Count('ratings')))
+    for product in products:
+        product.ratings_count = product.count
+    Product.objects.bulk_update(products, ['ratings_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_ratings_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2 on 2026-10-18 16:45
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Q
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    # Calculate rating sum and number of ratings of each value for existing products.
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.annotate(
+        sum=Sum('ratings__value'),
+        **{f'count_{value}': Count('ratings', filter=Q(ratings__value=value)) for value in range(1, 6)}
+    ))
+    for product in products:
+        product.ratings_sum = product.sum or 0
+        for value in range(1, 6):
+            setattr(product, f'ratings_count_{value}', getattr(product, f'count_{value}'))
+    fields = ['ratings_sum'] + [f'ratings_count_{value}' for value in range(1, 6)]
+    Product.objects.bulk_update(products, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_product_ratings_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
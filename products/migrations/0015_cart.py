@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('content', models.TextField(blank=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
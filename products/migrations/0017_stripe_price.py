@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_stripe_sync_intent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_product_id', models.CharField(max_length=220)),
+                ('currency', models.CharField(max_length=3)),
+                ('unit_amount', models.PositiveIntegerField()),
+                ('stripe_price_id', models.CharField(max_length=220, unique=True)),
+            ],
+            options={
+                'unique_together': {('stripe_product_id', 'currency', 'unit_amount')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
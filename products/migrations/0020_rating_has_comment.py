@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+def fill_has_comment(apps, schema_editor):
+    Rating = apps.get_model('products', 'Rating')
+    Rating.objects.exclude(comment='').update(has_comment=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_productimage_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='has_comment',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_has_comment, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['product', 'has_comment', 'created', 'id'], name='rating_comment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['product', 'has_comment', 'value', 'id'], name='rating_comment_value_idx'),
+        ),
+    ]
@@ -1,16 +1,19 @@
 import functools
 import operator
-from django.db import models
+from django.db import connections, models, router
 from django.core.exceptions import ValidationError
 import os
 import pathlib
-from PIL import Image
-from django.db.models import Q, Avg
+from django.db.models import Q, F, Avg, Sum, Count, Case, When, Value
+from django.db.models.functions import Cast, Round
 from django.conf import settings
 from django.shortcuts import get_object_or_404, reverse
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 from django.core.validators import MaxValueValidator
-import stripe
+from .registry import get_product_type
 # Create your models here.
 
 # Available product types
@@ -19,16 +22,11 @@ PRODUCT_TYPES = {'1': 'Shoe',
                  '3': 'Shirt',
                  '4': 'Backpack',}
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 
 def get_product_specific_model(product_type):
     # Returns ProductSpecific class model based on product_type.
-    type_name = PRODUCT_TYPES.get(str(product_type), '')
-    if not type_name:
-        return None
-    model_name = "Product"+type_name
-    return globals().get(model_name, None)
+    product_type = get_product_type(product_type)
+    return product_type.model if product_type is not None else None
 
 
 class Producer(models.Model):
@@ -44,7 +42,6 @@ class Producer(models.Model):
 class Product(models.Model):
     # General product model with common attributes for all products.
     TYPE_CHOICES = [(x, y) for x, y in PRODUCT_TYPES.items()]
-    product_specific_model = None
 
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField()
@@ -54,7 +51,26 @@ class Product(models.Model):
     type = models.CharField(choices=TYPE_CHOICES, max_length=3)
     promoted = models.BooleanField(default=False)
     avg_rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
+    # Rating aggregates updated incrementally after each rating change.
+    ratings_count = models.PositiveIntegerField(default=0)
+    ratings_sum = models.PositiveIntegerField(default=0)
+    ratings_count_1 = models.PositiveIntegerField(default=0)
+    ratings_count_2 = models.PositiveIntegerField(default=0)
+    ratings_count_3 = models.PositiveIntegerField(default=0)
+    ratings_count_4 = models.PositiveIntegerField(default=0)
+    ratings_count_5 = models.PositiveIntegerField(default=0)
     discount = models.PositiveIntegerField(default=0, validators=[MaxValueValidator(100)])
+    # Price after discount stored in database to allow filtering and ordering in queries, updated on save.
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    # Fields updated only with F() expressions after rating changes, never written by save().
+    RATING_AGGREGATE_FIELDS = ('avg_rating', 'ratings_count', 'ratings_sum', 'ratings_count_1', 'ratings_count_2',
+                               'ratings_count_3', 'ratings_count_4', 'ratings_count_5')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['type', 'effective_price'], name='product_type_price_idx'),
+            models.Index(fields=['type', 'avg_rating'], name='product_type_rating_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -64,6 +80,10 @@ class Product(models.Model):
         # Return main image object if assigned or first available image.
         if self.main_img.main_img is not None:
             return self.main_img.main_img
+        # Use first image loaded by card_cache.load_card_data if available.
+        first_images = getattr(self, 'first_images', None)
+        if first_images is not None:
+            return first_images[0] if first_images else None
         return self.images.first()
 
     def get_filtered_product_specific_attributes(self, query_dict):
@@ -101,31 +121,75 @@ class Product(models.Model):
     def get_product_specific_by_id(self, product_specific_id):
         return get_object_or_404(self.product_specific_model, product=self, id=product_specific_id)
 
+    @property
+    def product_specific_model(self):
+        # ProductSpecific class of this product type resolved from registry.
+        return get_product_specific_model(self.type)
+
     def get_product_specific_set(self):
-        if self.pk is None:
-            return None
-        type_name = PRODUCT_TYPES.get(self.type, '').lower()
-        if type_name == '':
+        model = self.product_specific_model
+        if self.pk is None or model is None:
             return None
-        product_specific_set_name = f"product{type_name}_set"
-        return getattr(self, product_specific_set_name).all()
+        return getattr(self, f"{model._meta.model_name}_set").all()
 
     def get_product_specific_model(self):
-        product_specific_set = self.get_product_specific_set()
-        if product_specific_set is not None:
-            return product_specific_set.model
-        else:
-            return None
+        return self.product_specific_model
 
     def update_rating(self):
-        calculated_avg = self.ratings.all().aggregate(Avg('value')).get('value__avg', None)
+        # Recalculate all rating aggregates from ratings table.
+        aggregated = self.ratings.all().aggregate(Avg('value'), Count('id'), Sum('value'))
+        calculated_avg = aggregated.get('value__avg', None)
         if calculated_avg is None:
             calculated_avg = 0
         self.avg_rating = calculated_avg
+        self.ratings_count = aggregated.get('id__count', 0)
+        self.ratings_sum = aggregated.get('value__sum', None) or 0
+        star_counts = dict(self.ratings.values_list('value').annotate(Count('id')).order_by())
+        for value, _ in Rating.VALUE_CHOICES:
+            setattr(self, f"ratings_count_{value}", star_counts.get(value, 0))
+
+    @classmethod
+    def recalculate_rating_aggregates(cls, product_id):
+        # Recalculate rating aggregates and save them without calling save().
+        product = cls.objects.get(id=product_id)
+        product.update_rating()
+        fields = ['avg_rating', 'ratings_count', 'ratings_sum'] + \
+            [f"ratings_count_{value}" for value, _ in Rating.VALUE_CHOICES]
+        cls.objects.filter(id=product_id).update(**{field: getattr(product, field) for field in fields})
+
+    @classmethod
+    def update_rating_aggregates(cls, product_id, added_value=None, removed_value=None):
+        # Update rating aggregates of product in database with atomic F() expressions, without calling save().
+        # added_value - value of new rating, removed_value - value of deleted rating. Both are passed when rating
+        # value changes.
+        if added_value == removed_value:
+            return
+        changes = {}
+        if added_value is not None:
+            changes['ratings_count'] = F('ratings_count') + 1
+            changes['ratings_sum'] = F('ratings_sum') + added_value
+            changes[f'ratings_count_{added_value}'] = F(f'ratings_count_{added_value}') + 1
+        if removed_value is not None:
+            changes['ratings_count'] = changes.get('ratings_count', F('ratings_count')) - 1
+            changes['ratings_sum'] = changes.get('ratings_sum', F('ratings_sum')) - removed_value
+            changes[f'ratings_count_{removed_value}'] = F(f'ratings_count_{removed_value}') - 1
+        products = cls.objects.filter(id=product_id)
+        products.update(**changes)
+        # Average calculated in separate query, so it uses updated sum and count in every database.
+        products.update(avg_rating=Case(
+            When(ratings_count=0, then=Value(0)),
+            default=Round(Cast(F('ratings_sum'), models.FloatField()) / F('ratings_count'), 1),
+            output_field=models.DecimalField(max_digits=2, decimal_places=1),
+        ))
 
     @property
     def number_of_ratings(self):
-        return self.ratings.count()
+        return self.ratings_count
+
+    @property
+    def ratings_histogram(self):
+        # Return dictionary with number of ratings for each value.
+        return {value: getattr(self, f"ratings_count_{value}") for value, _ in Rating.VALUE_CHOICES}
 
     @property
     def rating_percentage(self):
@@ -137,13 +201,19 @@ class Product(models.Model):
         return round(self.price * (100-self.discount)/100, 2)
 
     def save(self, **kwargs):
+        self.effective_price = self.current_price
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # Saving loaded rating aggregates would overwrite changes made by ratings in the meantime.
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.RATING_AGGREGATE_FIELDS]
+        elif update_fields is not None and ('price' in update_fields or 'discount' in update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'effective_price'}
         super().save(**kwargs)
-        # Update stripe prices of product specific
+        # Request update of stripe prices of product specific, done by sync_stripe command.
         product_specific_set = self.get_product_specific_set()
         if product_specific_set is not None:
-            for product_specific in product_specific_set:
-                product_specific.update_stripe_price()
-                product_specific.save()
+            StripeSyncIntent.request(product_specific_set.model, list(product_specific_set.values_list('id', flat=True)))
 
     def get_absolute_url(self):
         return reverse('products:detail', kwargs={"pk": self.pk})
@@ -163,6 +233,8 @@ class ProductSpecific(models.Model):
 
     stripe_product_id = models.CharField(max_length=220, null=True, blank=True)
     stripe_price_id = models.CharField(max_length=220, null=True, blank=True)
+    # Unit amount of stripe_price_id, allows skipping stripe calls when price has not changed.
+    stripe_price_amount = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         abstract = True
@@ -182,16 +254,14 @@ class ProductSpecific(models.Model):
 
     def save(self, **kwargs):
         self.validate_type()
-        stripe_product_object = stripe.Product.create(name=str(self))
-        self.stripe_product_id = stripe_product_object.stripe_id
-        self.update_stripe_price()
         super().save(**kwargs)
+        # Stripe product and price are created by sync_stripe command.
+        StripeSyncIntent.request(type(self), [self.id])
 
-    def update_stripe_price(self):
-        if self.stripe_product_id is not None:
-            stripe_price_object = stripe.Price.create(currency="pln", product=self.stripe_product_id,
-                                                      unit_amount=int(self.product.current_price*100))
-            self.stripe_price_id = stripe_price_object.stripe_id
+    @property
+    def stripe_unit_amount(self):
+        # Current price in stripe format - integer amount of smallest currency unit.
+        return int(self.product.current_price*100)
 
     def get_full_id(self):
         # return tuple containing referred general Product.id,ProductSpecific.id
@@ -239,16 +309,13 @@ class ProductSpecific(models.Model):
             query_set = cls.objects.all()
         if product is not None:
             query_set = query_set.filter(product=product)
-        # Get values as separate dictionaries for each object.
-        values = query_set.values(*cls.attribute_lookups)
+        # Get distinct sorted values of each attribute from database.
         combined = {}
-        # Combine dictionary values. Use set to avoid duplicates.
-        for value_dict in values:
-            for key, value in value_dict.items():
-                combined[key] = combined.get(key, set()).union([value])
-        # Cast set to list and sort values.
-        for key, values in combined.items():
-            combined[key] = sorted(list(values))
+        for lookup in cls.attribute_lookups:
+            values = list(query_set.exclude(**{f"{lookup}__isnull": True}).order_by(lookup)
+                          .values_list(lookup, flat=True).distinct())
+            if values:
+                combined[lookup] = values
         return combined
 
     @classmethod
@@ -362,37 +429,57 @@ def get_thumbnail_path(instance, filename):
 
 
 class ProductImage(models.Model):
-    # Table containing images and their thumbnails r
+    # Table containing uploaded images and their renditions. Uploaded image is stored as is, renditions are created
+    # by process_images command.
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     img = models.ImageField(upload_to=get_image_path)
-    thumbnail = models.ImageField(upload_to=get_thumbnail_path)
+    # Smallest rendition in JPEG format.
+    thumbnail = models.ImageField(upload_to=get_thumbnail_path, blank=True)
     description = models.TextField()
+    # Dimensions of uploaded image.
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Tiny blurred image (data URI) displayed while image is loading.
+    placeholder = models.TextField(blank=True, editable=False)
+    # {rendition name: {'width': width, 'height': height, format: path}}
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Time of processing, None if image waits for processing.
+    processed = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return f"{self.product.id}-{self.product.name} {self.id}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember loaded image path to process image again when it changes.
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_img = instance.img.name if 'img' in field_names else None
+        return instance
+
     def save(self, **kwargs):
+        # Renditions of replaced image are removed by pre_save signal.
         super().save(**kwargs)
-        # Rename image file as "{Product.id}_{ProductImage.id}",
-        # ProductImage.id available only after saving to DB
-        img_path = str(self.img)
-        print(img_path)
-        file_extension = pathlib.Path(img_path).suffix
-        head, tail = os.path.split(img_path)
-        new_img_path = os.path.join(head, f"{self.product.id}_{self.id}{file_extension}")
-        os.rename(os.path.join(settings.MEDIA_ROOT, img_path), os.path.join(settings.MEDIA_ROOT, new_img_path))
-        self.img = new_img_path
-
-        # Resize uploaded image and save
-        image = Image.open(self.img)
-        image.thumbnail((600, 600))
-        image.save(os.path.join(settings.MEDIA_ROOT, new_img_path))
-        # Create a thumbnail from uploaded image and assign it to thumbnail field
-        image.thumbnail((100, 100))
-        thumbnail_path = os.path.join(head, f"{self.product.id}_{self.id}_thumbnail{file_extension}")
-        image.save(os.path.join(settings.MEDIA_ROOT, thumbnail_path))
-        self.thumbnail = thumbnail_path
-        super().save(**kwargs)
+        self.loaded_img = self.img.name
+
+    @property
+    def rendition_urls(self):
+        # Returns {rendition name: {format: url}}. Until image is processed, renditions are resized on demand.
+        if not self.renditions:
+            return {name: {image_format: self.get_resized_url(size, image_format)
+                           for image_format in settings.IMAGE_RENDITION_FORMATS}
+                    for name, size in settings.IMAGE_RENDITIONS.items() if size in settings.IMAGE_RESIZE_SIZES}
+        return {name: {key: self.img.storage.url(value) for key, value in rendition.items()
+                       if key in settings.IMAGE_RENDITION_FORMATS}
+                for name, rendition in self.renditions.items()}
+
+    def get_resized_url(self, size, image_format):
+        return reverse('resized-image', kwargs={'width': size[0], 'height': size[1], 'image_id': self.id,
+                                                'image_format': image_format})
+
+    @property
+    def rendition_paths(self):
+        return {value for rendition in self.renditions.values() for key, value in rendition.items()
+                if key in settings.IMAGE_RENDITION_FORMATS}
 
 
 class ProductMainImage(models.Model):
@@ -426,6 +513,8 @@ class Rating(models.Model):
     value = models.IntegerField(choices=VALUE_CHOICES)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.TextField(blank=True)
+    # Set on save, allows selecting comments with index instead of comparing text.
+    has_comment = models.BooleanField(default=False, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
@@ -434,7 +523,87 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('product', 'user')
+        # Comments of product ordered by creation time or value (both directions) with id as tiebreaker.
+        indexes = [
+            models.Index(fields=['product', 'has_comment', 'created', 'id'], name='rating_comment_created_idx'),
+            models.Index(fields=['product', 'has_comment', 'value', 'id'], name='rating_comment_value_idx'),
+        ]
+
+    def save(self, **kwargs):
+        self.has_comment = self.comment != ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'comment' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'has_comment'}
+        super().save(**kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember value loaded from database to update product rating aggregates when value changes.
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_value = instance.value if 'value' in field_names else None
+        return instance
 
     @property
     def value_percentage(self):
         return self.value * 20
+
+
+class StripeSyncIntent(models.Model):
+    # Pending synchronization of ProductSpecific object with Stripe. One row per object, repeated requests only
+    # update requested time, so multiple changes are pushed to Stripe once by sync_stripe command.
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    product_specific = GenericForeignKey("content_type", "object_id")
+    requested = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+    def __str__(self):
+        return f"{self.content_type}-{self.object_id} requested: {self.requested}"
+
+    @classmethod
+    def request(cls, model, ids):
+        # Create or refresh sync intents of model objects with ids in one query.
+        if not ids:
+            return
+        content_type = ContentType.objects.get_for_model(model)
+        now = timezone.now()
+        intents = [cls(content_type=content_type, object_id=obj_id, requested=now) for obj_id in ids]
+        features = connections[router.db_for_write(cls)].features
+        if features.supports_update_conflicts_with_target:
+            cls.objects.bulk_create(intents, update_conflicts=True, update_fields=['requested'],
+                                    unique_fields=['content_type', 'object_id'])
+        elif features.supports_update_conflicts:
+            # MySQL - conflicts are detected on unique key of (content_type, object_id), target can't be passed.
+            cls.objects.bulk_create(intents, update_conflicts=True, update_fields=['requested'])
+        else:
+            cls.objects.filter(content_type=content_type, object_id__in=ids).update(requested=now)
+            cls.objects.bulk_create(intents, ignore_conflicts=True)
+
+
+class StripePrice(models.Model):
+    # Local copy of Stripe prices, allows reusing existing price instead of creating a new one with the same amount.
+    stripe_product_id = models.CharField(max_length=220)
+    currency = models.CharField(max_length=3)
+    unit_amount = models.PositiveIntegerField()
+    stripe_price_id = models.CharField(max_length=220, unique=True)
+
+    class Meta:
+        unique_together = ('stripe_product_id', 'currency', 'unit_amount')
+
+    def __str__(self):
+        return f"{self.stripe_product_id} {self.unit_amount} {self.currency}: {self.stripe_price_id}"
+
+
+class Cart(models.Model):
+    # Shopping cart storage. Key identifies user ("user_<User.id>") or anonymous visitor ("session_<cart id>").
+    # Content is stored in compact format: "<Product.id>_<ProductSpecific.id>:<amount>,..."
+    key = models.CharField(max_length=64, unique=True)
+    content = models.TextField(blank=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key}: {self.content}"
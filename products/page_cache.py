@@ -0,0 +1,120 @@
+import functools
+import gzip
+import hashlib
+import time
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from .cart import get_cart_length
+
+# Cache of whole pages rendered for anonymous visitors. Pages are stored gzip compressed under key built from path,
+# normalized query string and current versions of page tags. Changing data displayed on a page bumps version of its
+# tag, so all cached pages with this tag stop being used and expire after PAGE_CACHE_TIMEOUT.
+# Pages are cached only when they don't contain anything specific to a visitor - cart badge of non-empty cart or
+# messages - otherwise they are rendered as usual.
+
+# Tag of all cached pages, bumped when data displayed on every page changes.
+CATALOG_TAG = 'catalog'
+HOME_TAG = 'home'
+
+
+def get_product_tag(product_id):
+    return f"product_{product_id}"
+
+
+def get_product_type_tag(product_type):
+    return f"product_type_{product_type}"
+
+
+def get_tag_key(tag):
+    return f"page_tag_{tag}"
+
+
+def get_tag_versions(tags):
+    # Returns list of current versions of tags, missing versions are created. Versions are only added, so version set
+    # in the meantime by bump_tags is not overwritten.
+    keys = [get_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = time.time_ns()
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def bump_tags(*tags):
+    version = time.time_ns()
+    cache.set_many({get_tag_key(tag): version for tag in tags}, timeout=None)
+
+
+def invalidate_product_pages(product_id, product_type=None):
+    # Invalidate detail page of product, pages of its type and home page.
+    if product_type is None:
+        from .models import Product
+        product_type = Product.objects.filter(id=product_id).values_list('type', flat=True).first()
+    tags = [get_product_tag(product_id), HOME_TAG]
+    if product_type is not None:
+        tags.append(get_product_type_tag(product_type))
+    bump_tags(*tags)
+
+
+def invalidate_all_pages():
+    bump_tags(CATALOG_TAG)
+
+
+def get_page_key(request, tags):
+    # Query dict is normalized, so order of parameters doesn't create separate cache entries.
+    query = sorted((key, sorted(values)) for key, values in request.GET.lists())
+    versions = get_tag_versions([CATALOG_TAG, *tags])
+    digest = hashlib.md5(repr((request.path, query, versions)).encode()).hexdigest()
+    return f"page_{digest}"
+
+
+def is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    # Messages and cart badge are displayed on every page.
+    return len(get_messages(request)) == 0 and get_cart_length(request) == 0
+
+
+def is_cacheable_response(request, response):
+    # Response setting cookies or containing CSRF token is specific to a visitor.
+    return (response.status_code == 200 and not response.streaming and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+def build_response(request, cached):
+    content, content_type = cached
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(content, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(content), content_type=content_type)
+    response['Content-Length'] = str(len(response.content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def cache_anonymous_page(get_tags):
+    # Decorator of views caching pages of anonymous visitors. get_tags(request, *args, **kwargs) returns list of tags
+    # of the page.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_TIMEOUT or not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+            key = get_page_key(request, get_tags(request, *args, **kwargs))
+            cached = cache.get(key)
+            if cached is not None:
+                return build_response(request, cached)
+            response = view(request, *args, **kwargs)
+            if is_cacheable_response(request, response):
+                cached = (gzip.compress(response.content), response['Content-Type'])
+                cache.set(key, cached, timeout=settings.PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,69 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset (cursor) pagination. Instead of OFFSET, next page is selected with WHERE clause comparing ordering field and
+# id with values of the last object of previous page, so every page costs the same as the first one.
+# Cursor is passed in query string formatted as "<ordering field value>_<id>". Ordering field must not be nullable.
+
+PAGE_SIZE = 30
+# Number of rows read at once by keyset_paginate_filtered and maximum number of such windows read for one page.
+SCAN_WINDOW = 500
+MAX_SCAN_WINDOWS = 10
+
+
+def encode_cursor(obj, ordering):
+    field = obj._meta.get_field(ordering[0].lstrip('-'))
+    return f"{field.value_to_string(obj)}_{obj.id}"
+
+
+def decode_cursor(cursor, field):
+    # Returns tuple (value, id) from cursor string or None if cursor is incorrect.
+    try:
+        value, obj_id = cursor.rsplit('_', 1)
+        # Validators of field reject values which can't be compared with the column e.g. NaN or too many digits.
+        value = field.clean(value, None)
+        obj_id = int(obj_id)
+    except (ValueError, ValidationError):
+        return None
+    return value, obj_id
+
+
+def keyset_paginate(query_set, ordering, cursor=None, page_size=None):
+    # Returns list of objects on page following cursor and cursor of next page or None if this is the last page.
+    # ordering is a pair (field, id) sorted in the same direction e.g. ('-avg_rating', '-id').
+    page_size = page_size or PAGE_SIZE
+    field = ordering[0].lstrip('-')
+    lookup = 'lt' if ordering[0].startswith('-') else 'gt'
+    decoded = decode_cursor(cursor, query_set.model._meta.get_field(field)) if cursor else None
+    if decoded is not None:
+        value, obj_id = decoded
+        query_set = query_set.filter(Q(**{f"{field}__{lookup}": value}) | Q(**{field: value, f"id__{lookup}": obj_id}))
+    # Fetch one additional object to check if next page exists without counting rows.
+    objects = list(query_set.order_by(*ordering)[:page_size + 1])
+    next_cursor = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        next_cursor = encode_cursor(objects[-1], ordering)
+    return objects, next_cursor
+
+
+def keyset_paginate_filtered(query_set, ordering, accept, cursor=None, page_size=None):
+    # Keyset pagination of objects accepted by accept(id) function, used for filters which can't be expressed in SQL.
+    # Ids and ordering field values are read in windows following cursor until page is full, then objects of the page
+    # are loaded with one query. At most MAX_SCAN_WINDOWS windows are read, if few objects are accepted page can be
+    # shorter than page_size and next page continues after the last read row.
+    page_size = page_size or PAGE_SIZE
+    field = ordering[0].lstrip('-')
+    keys = query_set.only('id', field)
+    page = []
+    for _ in range(MAX_SCAN_WINDOWS):
+        window, cursor = keyset_paginate(keys, ordering, cursor, page_size=SCAN_WINDOW)
+        page.extend(obj for obj in window if accept(obj.id))
+        if cursor is None or len(page) > page_size:
+            break
+    next_cursor = cursor
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1], ordering)
+    objects = list(query_set.filter(id__in=[obj.id for obj in page]).order_by(*ordering))
+    return objects, next_cursor
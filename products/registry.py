@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+
+# Registry of product types. Maps PRODUCT_TYPES codes to ProductSpecific models with their attribute lookups and
+# API serializers. Built once in ProductsConfig.ready(), so resolving model of a product doesn't need any lookups
+# by name or signal handlers.
+
+
+class ProductTypeEntry:
+
+    def __init__(self, code, name, model):
+        self.code = code
+        self.name = name
+        self.model = model
+        self.attribute_lookups = tuple(model.attribute_lookups)
+        self.attribute_field_names = tuple(model.attribute_field_names)
+        # {kind: serializer class} registered by api app.
+        self.serializers = {}
+
+
+# {type code: ProductTypeEntry}
+product_types = {}
+
+
+def build_registry():
+    from .models import PRODUCT_TYPES, ProductSpecific
+    models = {model.TYPE: model for model in apps.get_app_config('products').get_models()
+              if issubclass(model, ProductSpecific)}
+    for code, name in PRODUCT_TYPES.items():
+        if code not in models:
+            raise ImproperlyConfigured(f"No ProductSpecific model with TYPE = '{code}' ({name}).")
+        product_types[code] = ProductTypeEntry(code, name, models[code])
+
+
+def get_product_type(code):
+    # Returns ProductTypeEntry of product type code or None if type doesn't exist.
+    return product_types.get(str(code))
+
+
+def get_product_specific_models():
+    return [entry.model for entry in product_types.values()]
+
+
+def register_serializers(kind, serializer_factory):
+    # Create serializer class for every ProductSpecific model with serializer_factory(model).
+    for entry in product_types.values():
+        entry.serializers[kind] = serializer_factory(entry.model)
@@ -1,18 +1,45 @@
-from django.db.models.signals import post_delete, post_save, post_init
+from django.db.models.signals import post_delete, post_save, pre_save, pre_delete
 from django.dispatch import receiver
-from .models import ProductImage, Product, ProductMainImage, Rating
-import os
+from django.db import transaction
+from .models import ProductImage, Product, ProductMainImage, Rating, Color
+from .registry import get_product_specific_models, get_product_type
+from .variant_index import get_variant_index
+from .variant_matrix import invalidate_variant_matrix, invalidate_all_variant_matrices
+from .cart_store import merge_session_cart
+from .page_cache import invalidate_product_pages, invalidate_all_pages
+from .card_cache import invalidate_product_card
+from .images import delete_files
+from django.contrib.auth.signals import user_logged_in
 
 
-@receiver(post_delete, sender=ProductImage)
+@receiver(pre_delete, sender=ProductImage)
 def auto_delete_image_file(sender, instance, using, **kwargs):
-    # Delete image file and thumbnail file after ProductImage object is deleted.
-    img_path = instance.img.path
-    thumbnail_path = instance.thumbnail.path
-    if os.path.exists(img_path):
-        os.remove(img_path)
-    if os.path.exists(thumbnail_path):
-        os.remove(thumbnail_path)
+    # Delete uploaded image, thumbnail and rendition files after ProductImage object is deleted. Renditions are loaded
+    # from database, because they could be replaced by process_images command after instance was loaded.
+    current = ProductImage.objects.filter(id=instance.id).first() or instance
+    paths = current.rendition_paths | {current.img.name, current.thumbnail.name}
+    transaction.on_commit(lambda: delete_files(paths))
+
+
+@receiver(pre_save, sender=ProductImage)
+def reset_image_renditions(sender, instance, **kwargs):
+    # New image uploaded - delete renditions of previous image, new ones are created by process_images command.
+    if instance.img.name == getattr(instance, 'loaded_img', None):
+        return
+    paths = instance.rendition_paths | {instance.thumbnail.name}
+    instance.renditions = {}
+    instance.thumbnail = ''
+    instance.width = instance.height = None
+    instance.placeholder = ''
+    instance.processed = None
+    transaction.on_commit(lambda: delete_files(paths))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_variant_matrix(sender, instance, **kwargs):
+    # Variant matrix contains product price.
+    product_id = instance.id
+    transaction.on_commit(lambda: invalidate_variant_matrix(product_id))
 
 
 @receiver(post_save, sender=Product)
@@ -23,23 +50,86 @@ def create_product_main_img(sender, instance, created, **kwargs):
         prod_main_img.save()
 
 
-@receiver(post_init, sender=Product)
-def assign_model(sender, instance, **kwargs):
-    # Assign ProductSpecific class to object of Product class on init.
-    if instance.pk is not None:
-        instance.product_specific_model = instance.get_product_specific_model()
-
-
-
 @receiver(post_save, sender=Rating)
 def update_product_rating_save(sender, instance, created, **kwargs):
-    # Update products average rating after rating is saved.
-    instance.product.update_rating()
-    instance.product.save()
+    # Update products rating aggregates after rating is saved.
+    if created:
+        Product.update_rating_aggregates(instance.product_id, added_value=instance.value)
+    else:
+        loaded_value = getattr(instance, 'loaded_value', None)
+        if loaded_value is None:
+            # Previous value unknown - recalculate aggregates from ratings table.
+            Product.recalculate_rating_aggregates(instance.product_id)
+        else:
+            Product.update_rating_aggregates(instance.product_id, added_value=instance.value,
+                                             removed_value=loaded_value)
+    instance.loaded_value = instance.value
 
 
 @receiver(post_delete, sender=Rating)
 def update_product_rating_delete(sender, instance, **kwargs):
-    # Update products average rating after rating is deleted.
-    instance.product.update_rating()
-    instance.product.save()
+    # Update products rating aggregates after rating is deleted.
+    removed_value = getattr(instance, 'loaded_value', None) or instance.value
+    Product.update_rating_aggregates(instance.product_id, removed_value=removed_value)
+
+
+def update_variant_index(sender, instance, **kwargs):
+    # Update variant index of this product type and variant matrix of product after changes are committed.
+    variant_id = instance.id
+    product_id = instance.product_id
+    transaction.on_commit(lambda: get_variant_index(sender).update(variant_id))
+    transaction.on_commit(lambda: invalidate_variant_matrix(product_id))
+    transaction.on_commit(lambda: invalidate_product_pages(product_id, sender.TYPE))
+
+
+for product_specific_model in get_product_specific_models():
+    post_save.connect(update_variant_index, sender=product_specific_model)
+    post_delete.connect(update_variant_index, sender=product_specific_model)
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def rebuild_variant_indexes(sender, instance, **kwargs):
+    # Color names are stored in indexes and variant matrices of all product types.
+    def bump_versions():
+        for model in get_product_specific_models():
+            get_variant_index(model).bump_version()
+        invalidate_all_variant_matrices()
+        invalidate_all_pages()
+    transaction.on_commit(bump_versions)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pages_product(sender, instance, **kwargs):
+    product_id, product_type = instance.id, instance.type
+    transaction.on_commit(lambda: invalidate_product_pages(product_id, product_type))
+    transaction.on_commit(lambda: invalidate_product_card(product_id))
+
+
+@receiver(post_save, sender=Product)
+def update_variant_index_price(sender, instance, **kwargs):
+    # Prices of products are stored in variant index of their type.
+    product_id, product_type = instance.id, get_product_type(instance.type)
+    if product_type is not None:
+        transaction.on_commit(lambda: get_variant_index(product_type.model).update_product(product_id))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductMainImage)
+@receiver(post_delete, sender=ProductMainImage)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_product_pages_related(sender, instance, **kwargs):
+    # Images and ratings are displayed on product cards and detail page.
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_product_pages(product_id))
+    transaction.on_commit(lambda: invalidate_product_card(product_id))
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # Keep products added to cart before logging in.
+    if request is not None:
+        merge_session_cart(request, user)
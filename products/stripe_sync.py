@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+import operator
+import stripe
+from django.conf import settings
+from django.db.models import Q, F
+from .models import StripeSyncIntent, StripePrice
+
+# Synchronization of ProductSpecific objects with Stripe products and prices. Local changes only create
+# StripeSyncIntent rows, this module pushes them to Stripe in background (sync_stripe command).
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_base = settings.STRIPE_API_BASE
+
+
+def push_to_stripe(task):
+    # Create stripe product and/or price. Runs in worker thread, must not use database.
+    # Returns tuple (stripe product id, stripe price id, error).
+    stripe_product_id = task['stripe_product_id']
+    try:
+        if stripe_product_id is None:
+            stripe_product_id = stripe.Product.create(name=task['name']).stripe_id
+        price = stripe.Price.create(currency=settings.STRIPE_CURRENCY, product=stripe_product_id,
+                                    unit_amount=task['unit_amount'])
+        return stripe_product_id, price.stripe_id, None
+    except stripe.error.StripeError as error:
+        return stripe_product_id, None, error
+
+
+def get_known_prices(stripe_product_ids):
+    # Returns dictionary {(stripe product id, unit amount): stripe price id} of prices saved locally.
+    prices = StripePrice.objects.filter(currency=settings.STRIPE_CURRENCY, stripe_product_id__in=stripe_product_ids)
+    return {(price.stripe_product_id, price.unit_amount): price.stripe_price_id for price in prices}
+
+
+def save_known_prices(prices):
+    # Save list of tuples (stripe product id, currency, unit amount, stripe price id) in local price mapping.
+    StripePrice.objects.bulk_create([
+        StripePrice(stripe_product_id=product_id, currency=currency, unit_amount=unit_amount, stripe_price_id=price_id)
+        for product_id, currency, unit_amount, price_id in prices
+    ], ignore_conflicts=True)
+
+
+def backfill_known_prices(page_size=100):
+    # Load all active prices from Stripe into local price mapping. Returns number of loaded prices.
+    prices = []
+    loaded = 0
+    for price in stripe.Price.list(active=True, limit=page_size).auto_paging_iter():
+        if price.get('unit_amount') is None or price.get('product') is None:
+            continue
+        prices.append((price['product'], price['currency'], price['unit_amount'], price['id']))
+        loaded += 1
+        if len(prices) >= page_size:
+            save_known_prices(prices)
+            prices = []
+    save_known_prices(prices)
+    return loaded
+
+
+def sync_pending(batch_size=100, concurrency=None, stdout=None):
+    # Push one batch of pending sync intents to Stripe with at most concurrency parallel requests.
+    # Returns tuple (number of processed intents, number of stripe pushes, number of errors).
+    if concurrency is None:
+        concurrency = settings.STRIPE_SYNC_CONCURRENCY
+    intents = list(StripeSyncIntent.objects.select_related('content_type').order_by('attempts', 'requested')
+                   [:batch_size])
+    if not intents:
+        return 0, 0, 0
+    # Load ProductSpecific objects grouped by model, one query for each model.
+    grouped = {}
+    for intent in intents:
+        grouped.setdefault(intent.content_type, []).append(intent)
+    tasks = []
+    done = []
+    for content_type, model_intents in grouped.items():
+        model = content_type.model_class()
+        objects = model.objects.select_related('product', 'color').in_bulk([intent.object_id for intent in model_intents])
+        for intent in model_intents:
+            product_specific = objects.get(intent.object_id)
+            # Skip deleted objects and objects with unchanged price.
+            if product_specific is None or (product_specific.stripe_price_id is not None and
+                                            product_specific.stripe_price_amount == product_specific.stripe_unit_amount):
+                done.append(intent)
+                continue
+            tasks.append({'intent': intent, 'model': model, 'id': product_specific.id, 'name': str(product_specific),
+                          'stripe_product_id': product_specific.stripe_product_id,
+                          'unit_amount': product_specific.stripe_unit_amount})
+    # Reuse prices already existing in Stripe with the same amount.
+    known_prices = get_known_prices({task['stripe_product_id'] for task in tasks if task['stripe_product_id']})
+    new_prices_tasks = []
+    for task in tasks:
+        stripe_price_id = known_prices.get((task['stripe_product_id'], task['unit_amount']))
+        if stripe_price_id is None:
+            new_prices_tasks.append(task)
+            continue
+        task['model'].objects.filter(id=task['id']).update(stripe_price_id=stripe_price_id,
+                                                           stripe_price_amount=task['unit_amount'])
+        done.append(task['intent'])
+    tasks = new_prices_tasks
+    errors = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(push_to_stripe, tasks))
+    for task, (stripe_product_id, stripe_price_id, error) in zip(tasks, results):
+        intent = task['intent']
+        # Stripe product could be created even if price creation failed.
+        update = {'stripe_product_id': stripe_product_id}
+        if error is None:
+            update.update(stripe_price_id=stripe_price_id, stripe_price_amount=task['unit_amount'])
+            done.append(intent)
+        else:
+            errors.append(intent)
+            StripeSyncIntent.objects.filter(id=intent.id).update(attempts=F('attempts') + 1, last_error=str(error))
+            if stdout is not None:
+                stdout.write(f"Sync of {task['name']} failed: {error}")
+        task['model'].objects.filter(id=task['id']).update(**update)
+    save_known_prices([(stripe_product_id, settings.STRIPE_CURRENCY, task['unit_amount'], stripe_price_id)
+                       for task, (stripe_product_id, stripe_price_id, error) in zip(tasks, results) if error is None])
+    # Remove intents which were not requested again during synchronization.
+    if done:
+        StripeSyncIntent.objects.filter(
+            reduce(operator.or_, [Q(id=intent.id, requested=intent.requested) for intent in done])
+        ).delete()
+    return len(intents), len(tasks), len(errors)
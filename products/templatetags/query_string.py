@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter(name="remove_cursor")
+def remove_cursor(query_dict):
+    """Returns urlencoded query_dict without pagination cursor"""
+    query_dict = query_dict.copy()
+    query_dict.pop('cursor', None)
+    return query_dict.urlencode()
@@ -1,3 +1,828 @@
-from django.test import TestCase
+import itertools
+import os
+import tempfile
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.db.models.query import QuerySet
+from django.http import QueryDict
+from .models import Producer, Product, ProductShoe, ProductImage, ProductMainImage, Color, Rating, StripeSyncIntent, \
+    StripePrice, Cart
+from .cart_store import get_cache_key
+from .card_cache import get_version_key, invalidate_product_card, render_product_cards
+from .image_cache import DiskCache
+from .management.commands.import_images import find_products, get_product, get_product_keys
+from .stripe_sync import sync_pending
+from .page_cache import bump_tags, get_tag_key, get_tag_versions
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+from .variant_index import VariantIndex, get_variant_index
 
 # Create your tests here.
+
+# Cache kept in memory for tests counting queries, so only queries of the page are counted, not cache reads of
+# database cache backend.
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0, CACHES=LOCAL_CACHES)
+class ProductListingQueriesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        self.color = Color.objects.create(name='red')
+        self.user = User.objects.create_user(username='user', email='user@example.com', password='pass')
+
+    def create_products(self, count):
+        start = Product.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(start, start + count):
+                self.create_product(i)
+
+    def create_product(self, i):
+        # Create product with variant, images, main image and rating.
+        product = Product.objects.create(name=f'Shoe {i}', description='Shoe', price=100, producer=self.producer,
+                                         type='1', promoted=True)
+        ProductShoe.objects.create(product=product, available=True, size=40, color=self.color)
+        images = ProductImage.objects.bulk_create([
+            ProductImage(product=product, img=f'images/Shoe/{product.id}_{n}.jpg',
+                         thumbnail=f'images/Shoe/{product.id}_{n}_thumbnail.jpg', description='Image')
+            for n in range(2)])
+        if i % 2:
+            ProductMainImage.objects.filter(product=product).update(main_img=images[1])
+        Rating.objects.create(product=product, user=self.user, value=4)
+
+    def count_queries(self, url):
+        # First request builds in-memory variant index.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_category_page_queries_do_not_depend_on_number_of_products(self):
+        url = reverse('products:type', kwargs={'product_type': 1})
+        self.create_products(2)
+        small_page_queries = self.count_queries(url)
+        self.create_products(8)
+        self.assertEqual(self.count_queries(url), small_page_queries)
+
+    def test_home_page_queries_do_not_depend_on_number_of_products(self):
+        url = reverse('pages:home')
+        self.create_products(2)
+        small_page_queries = self.count_queries(url)
+        self.create_products(7)
+        self.assertEqual(self.count_queries(url), small_page_queries)
+
+    def test_ratings_count_is_stored_on_product(self):
+        self.create_products(1)
+        product = Product.objects.get()
+        self.assertEqual(product.ratings_count, 1)
+        Rating.objects.get(product=product).delete()
+        product.refresh_from_db()
+        self.assertEqual(product.ratings_count, 0)
+
+
+class RatingAggregatesTest(TestCase):
+
+    def setUp(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        self.product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        ProductShoe.objects.create(product=self.product, available=True, size=40,
+                                   color=Color.objects.create(name='red'))
+        self.users = [User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass')
+                      for i in range(3)]
+
+    def test_rating_changes_update_aggregates_without_stripe_sync(self):
+        StripeSyncIntent.objects.all().delete()
+        for user, value in zip(self.users, [5, 4, 4]):
+            Rating.objects.create(product=self.product, user=user, value=value)
+        rating = Rating.objects.get(user=self.users[0])
+        rating.value = 1
+        rating.save()
+        Rating.objects.get(user=self.users[1]).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.ratings_count, 2)
+        self.assertEqual(self.product.ratings_sum, 5)
+        self.assertEqual(str(self.product.avg_rating), '2.5')
+        self.assertEqual(self.product.ratings_histogram, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+        self.assertFalse(StripeSyncIntent.objects.exists())
+
+    def test_product_save_does_not_overwrite_rating_aggregates(self):
+        # Product loaded before rating was added, e.g. in admin form.
+        stale_product = Product.objects.get(id=self.product.id)
+        Rating.objects.create(product=self.product, user=self.users[0], value=5)
+        stale_product.description = 'New description'
+        stale_product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.description, 'New description')
+        self.assertEqual(self.product.ratings_count, 1)
+        self.assertEqual(self.product.ratings_sum, 5)
+        self.assertEqual(str(self.product.avg_rating), '5.0')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ProductDetailQueriesTest(TestCase):
+    # Product, producer, images, variants and first page of comments, session and user.
+    QUERY_BUDGET = 6
+
+    def setUp(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        self.product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        self.colors = [Color.objects.create(name=name) for name in ('red', 'blue')]
+        self.user = User.objects.create_user(username='user', email='user@example.com', password='pass')
+        self.client.force_login(self.user)
+        self.url = reverse('products:detail', kwargs={'pk': self.product.pk})
+
+    def add_data(self, count):
+        # Add count variants, images and comments to product.
+        with self.captureOnCommitCallbacks(execute=True):
+            start = ProductShoe.objects.filter(product=self.product).count()
+            for i in range(start, start + count):
+                ProductShoe.objects.create(product=self.product, available=True, size=36 + i,
+                                           color=self.colors[i % 2])
+                ProductImage.objects.create(product=self.product, img=f'images/Shoe/{self.product.id}_{i}.jpg',
+                                            thumbnail=f'images/Shoe/{self.product.id}_{i}_thumbnail.jpg')
+                user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass')
+                Rating.objects.create(product=self.product, user=user, value=4, comment=f'Comment {i}')
+
+    def count_queries(self, query=''):
+        # First request loads cart of user into cache.
+        self.client.get(f'{self.url}{query}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'{self.url}{query}')
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_detail_page_stays_within_query_budget(self):
+        self.add_data(2)
+        self.assertLessEqual(self.count_queries(), self.QUERY_BUDGET)
+        self.add_data(10)
+        self.assertLessEqual(self.count_queries(), self.QUERY_BUDGET)
+        # Selection of all attributes.
+        self.assertLessEqual(self.count_queries('?size=36&color__name=red'), self.QUERY_BUDGET)
+
+    def test_detail_page_queries_do_not_depend_on_product_data(self):
+        self.add_data(2)
+        small_page_queries = self.count_queries()
+        self.add_data(10)
+        self.assertEqual(self.count_queries(), small_page_queries)
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class CategoryPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        colors = [Color.objects.create(name=name) for name in ('red', 'blue')]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(40):
+                product = Product.objects.create(name=f'Shoe {i}', description='Shoe', price=100 + i % 7,
+                                                 producer=producer, type='1')
+                ProductShoe.objects.create(product=product, available=i % 5 != 0, size=40 + i % 3,
+                                           color=colors[i % 2])
+
+    def get_all_pages(self, query, on_page=None):
+        # Returns ids of products from all pages of category following next page links. on_page() is called after
+        # every page.
+        ids = []
+        url = f"{reverse('products:type', kwargs={'product_type': 1})}?{query}"
+        while url:
+            response = self.client.get(url)
+            ids += [product.id for product in response.context['products']]
+            if on_page is not None:
+                on_page()
+            next_page_query = response.context['next_page_query']
+            url = f"{response.request['PATH_INFO']}?{next_page_query}" if next_page_query else None
+        return ids
+
+    @mock.patch('products.pagination.PAGE_SIZE', 4)
+    def test_filtering_while_paginating_returns_the_same_products_as_id_list(self):
+        for query in ['', 'size=41', 'color__name=red&order=3', 'size=40&size=42&price_to=103&order=2']:
+            with mock.patch('products.variant_index.ID_LIST_LIMIT', 1000):
+                expected = self.get_all_pages(query)
+            with mock.patch('products.variant_index.ID_LIST_LIMIT', 0), \
+                    mock.patch('products.pagination.SCAN_WINDOW', 3):
+                self.assertEqual(self.get_all_pages(query), expected)
+            self.assertTrue(expected)
+
+    @mock.patch('products.pagination.PAGE_SIZE', 4)
+    @mock.patch('products.pagination.SCAN_WINDOW', 3)
+    @mock.patch('products.pagination.MAX_SCAN_WINDOWS', 2)
+    def test_scan_of_filtered_pages_is_limited(self):
+        with mock.patch('products.variant_index.ID_LIST_LIMIT', 1000):
+            expected = self.get_all_pages('size=41&color__name=red')
+        windows = []
+        with mock.patch('products.variant_index.ID_LIST_LIMIT', 0), \
+                mock.patch('products.pagination.keyset_paginate', wraps=keyset_paginate) as paginate:
+            def on_page():
+                windows.append(paginate.call_count)
+                paginate.reset_mock()
+            self.assertEqual(self.get_all_pages('size=41&color__name=red', on_page), expected)
+        self.assertEqual(max(windows), 2)
+        # All 40 products are read once in windows of 3 rows.
+        self.assertEqual(sum(windows), 14)
+
+
+class KeysetPaginationTest(TestCase):
+    ORDERINGS = [('effective_price', 'id'), ('-effective_price', '-id'), ('-avg_rating', '-id'), ('avg_rating', 'id')]
+
+    def setUp(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        # Few distinct prices and ratings, so many products have the same value of ordering field.
+        for i in range(11):
+            product = Product.objects.create(name=f'Shoe {i}', description='Shoe', price=100 + i % 3,
+                                             producer=producer, type='1')
+            Product.objects.filter(id=product.id).update(avg_rating=Decimal(i % 2) + Decimal('3.5'))
+        self.query_set = Product.objects.filter(type='1')
+
+    def test_pages_follow_ordering_with_ties(self):
+        for ordering in self.ORDERINGS:
+            expected = list(self.query_set.order_by(*ordering))
+            ids = []
+            cursor = None
+            while True:
+                page, cursor = keyset_paginate(self.query_set, ordering, cursor, page_size=3)
+                ids += [product.id for product in page]
+                if cursor is None:
+                    break
+                # Cursor points at the last product of the page.
+                self.assertEqual(cursor, encode_cursor(page[-1], ordering))
+                self.assertEqual(decode_cursor(cursor, Product._meta.get_field(ordering[0].lstrip('-'))),
+                                 (getattr(page[-1], ordering[0].lstrip('-')), page[-1].id))
+            self.assertEqual(ids, [product.id for product in expected], ordering)
+
+    def test_invalid_cursor_returns_first_page(self):
+        for ordering in self.ORDERINGS:
+            first_page, _ = keyset_paginate(self.query_set, ordering, page_size=3)
+            for cursor in ['abc', '1_x', '_1', '100.00_', 'nan_5', 'inf_1', '-Infinity_1', '1e999999_1', '1.234_1']:
+                page, _ = keyset_paginate(self.query_set, ordering, cursor, page_size=3)
+                self.assertEqual(page, first_page, (ordering, cursor))
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_category_page_with_invalid_cursor(self):
+        url = reverse('products:type', kwargs={'product_type': 1})
+        first_page = self.client.get(f'{url}?order=3').context['products']
+        response = self.client.get(f'{url}?order=3&cursor=nan_5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['products']), list(first_page))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class FacetsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        colors = [Color.objects.create(name=name) for name in ('red', 'blue', 'green')]
+        self.products = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(12):
+                product = Product.objects.create(name=f'Shoe {i}', description='Shoe', price=100 + i % 4,
+                                                 producer=producer, type='1')
+                self.products.append(product)
+                for n in range(i % 3 + 1):
+                    ProductShoe.objects.create(product=product, available=(i + n) % 5 != 0, size=40 + (i + n) % 3,
+                                               color=colors[(i * n) % 3])
+        self.index = get_variant_index(ProductShoe)
+
+    def get_expected_facets(self, query_dict, price_from=None, price_to=None):
+        # Count products matching selections with database queries.
+        selected = {lookup: query_dict.getlist(lookup) for lookup in ProductShoe.attribute_lookups
+                    if query_dict.getlist(lookup)}
+        variants = ProductShoe.objects.filter(available=True)
+        if price_from is not None:
+            variants = variants.filter(product__effective_price__gte=price_from)
+        if price_to is not None:
+            variants = variants.filter(product__effective_price__lte=price_to)
+        facets = {}
+        for lookup in ProductShoe.attribute_lookups:
+            other = variants
+            for other_lookup, values in selected.items():
+                if other_lookup != lookup:
+                    other = other.filter(**{f'{other_lookup}__in': values})
+            facets[lookup] = [
+                (value, other.filter(**{lookup: value}).values('product').distinct().count())
+                for value in sorted(set(variants.model.objects.filter(available=True).values_list(lookup, flat=True)))
+            ]
+        return facets
+
+    def assert_facets(self):
+        for query, price_from, price_to in [('', None, None), ('size=41', None, None),
+                                            ('size=41&color__name=red', None, None),
+                                            ('size=40&size=42&color__name=blue', 101, None),
+                                            ('color__name=green', None, 102), ('', 101, 102)]:
+            query_dict = QueryDict(query)
+            self.assertEqual(self.index.get_facets(query_dict, price_from, price_to),
+                             self.get_expected_facets(query_dict, price_from, price_to))
+
+    def test_facet_counts_match_database(self):
+        self.assert_facets()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].price = 103
+            self.products[1].save()
+            self.products[2].discount = 50
+            self.products[2].save()
+            variant = ProductShoe.objects.filter(product=self.products[3], available=True).first()
+            variant.available = False
+            variant.save()
+            ProductShoe.objects.create(product=self.products[5], available=True, size=41,
+                                       color=Color.objects.get(name='green'))
+        self.assert_facets()
+
+    def test_invalid_value_returns_zero_counts(self):
+        facets = self.index.get_facets(QueryDict('size=abc'))
+        self.assertTrue(facets['size'])
+        self.assertFalse(any(count for lookup in facets for _, count in facets[lookup]))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class VariantIndexVersionTest(TestCase):
+
+    def test_index_is_rebuilt_after_version_is_removed_from_cache(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        variant = ProductShoe.objects.create(product=product, available=True, size=40,
+                                             color=Color.objects.create(name='red'))
+        index = VariantIndex(ProductShoe)
+        self.assertEqual(index.filter_variants(QueryDict('size=41')), 0)
+        # Change made by another process after version was evicted from cache.
+        ProductShoe.objects.filter(id=variant.id).update(size=41)
+        cache.clear()
+        self.assertEqual(index.filter_variants(QueryDict('size=41')), 1 << variant.id)
+
+
+class CartStoreTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        self.variant = ProductShoe.objects.create(product=product, available=True, size=40,
+                                                  color=Color.objects.create(name='red'))
+
+    def test_cart_stored_in_session_by_previous_version_is_migrated(self):
+        session = self.client.session
+        session['cart'] = {self.variant.get_full_id(): 2}
+        session['cart_length'] = 2
+        session.save()
+        response = self.client.get(reverse('products:cart'))
+        self.assertEqual(response.context['cart_length'], 2)
+        self.assertNotIn('cart', self.client.session)
+        self.assertNotIn('cart_length', self.client.session)
+        # Cart is read from cart store on next requests.
+        response = self.client.get(reverse('products:cart'))
+        self.assertEqual(response.context['cart_length'], 2)
+
+    def add_to_cart(self):
+        self.client.get(reverse('products:add-cart',
+                                kwargs={'p_id': self.variant.product_id, 'ps_id': self.variant.pk}))
+
+    def assert_read_only_pages_do_not_write(self):
+        urls = [reverse('pages:home'), reverse('products:type', kwargs={'product_type': 1}),
+                reverse('products:detail', kwargs={'pk': self.variant.product_id}), reverse('products:cart')]
+        for url in urls:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            writes = [query['sql'] for query in context.captured_queries
+                      if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+            self.assertEqual(writes, [], url)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies, url)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0, CACHES=LOCAL_CACHES)
+    def test_read_only_pages_do_not_write_cart_or_session(self):
+        # Anonymous visitor without cart, with cart and logged-in user with cart.
+        self.assert_read_only_pages_do_not_write()
+        self.add_to_cart()
+        self.assert_read_only_pages_do_not_write()
+        self.client.force_login(User.objects.create_user(username='user', email='user@example.com', password='pass'))
+        self.assert_read_only_pages_do_not_write()
+
+    def test_anonymous_cart_is_merged_on_login(self):
+        user = User.objects.create_user(username='user', email='user@example.com', password='pass')
+        Cart.objects.create(key=f"user_{user.id}", content=f"{self.variant.get_full_id()}:1")
+        self.add_to_cart()
+        self.add_to_cart()
+        session_key = f"session_{self.client.session['cart_id']}"
+        self.client.force_login(user)
+        response = self.client.get(reverse('products:cart'))
+        self.assertEqual(response.context['cart_length'], 3)
+        self.assertNotIn('cart_id', self.client.session)
+        self.assertFalse(Cart.objects.filter(key=session_key).exists())
+        self.assertEqual(Cart.objects.get(key=f"user_{user.id}").content, f"{self.variant.get_full_id()}:3")
+
+    def test_old_anonymous_carts_are_pruned(self):
+        content = f"{self.variant.get_full_id()}:1"
+        for key in ['session_old', 'session_new', 'user_1']:
+            Cart.objects.create(key=key, content=content)
+        Cart.objects.filter(key__in=['session_old', 'user_1']) \
+            .update(modified=timezone.now() - timedelta(seconds=settings.CART_ANONYMOUS_MAX_AGE + 1))
+        cache.set(get_cache_key('session_old'), content)
+        call_command('prune_carts', batch_size=1, stdout=StringIO())
+        self.assertEqual(set(Cart.objects.values_list('key', flat=True)), {'session_new', 'user_1'})
+        self.assertIsNone(cache.get(get_cache_key('session_old')))
+
+
+class StripeSyncIntentTest(TestCase):
+
+    def setUp(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        color = Color.objects.create(name='red')
+        self.ids = [ProductShoe.objects.create(product=product, available=True, size=size, color=color).id
+                    for size in (40, 41)]
+
+    def request_twice(self):
+        StripeSyncIntent.objects.all().delete()
+        StripeSyncIntent.request(ProductShoe, self.ids[:1])
+        first = StripeSyncIntent.objects.get().requested
+        StripeSyncIntent.request(ProductShoe, self.ids)
+        intents = dict(StripeSyncIntent.objects.values_list('object_id', 'requested'))
+        self.assertEqual(set(intents), set(self.ids))
+        self.assertGreaterEqual(intents[self.ids[0]], first)
+
+    def test_repeated_requests_keep_one_intent_per_object(self):
+        self.request_twice()
+
+    def test_request_without_upsert_support(self):
+        with mock.patch.multiple(connection.features, supports_update_conflicts=False,
+                                 supports_update_conflicts_with_target=False):
+            self.request_twice()
+
+    def test_request_uses_upsert_options_supported_by_backend(self):
+        # Options are validated like by bulk_create of database without conflict target support (MySQL).
+        def check_options(query_set, objs, ignore_conflicts=False, update_conflicts=False, update_fields=None,
+                          unique_fields=None, **kwargs):
+            def get_fields(names):
+                return [query_set.model._meta.get_field(name) for name in names or []]
+            query_set._check_bulk_create_options(ignore_conflicts, update_conflicts, get_fields(update_fields),
+                                                 get_fields(unique_fields))
+            return objs
+        with mock.patch.multiple(connection.features, supports_update_conflicts=True,
+                                 supports_update_conflicts_with_target=False), \
+                mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=check_options) as bulk_create:
+            StripeSyncIntent.request(ProductShoe, self.ids)
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    # Minimal Stripe API creating products and prices. First server.failures price requests fail with server error.
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        form = {key: values[0] for key, values in
+                parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode()).items()}
+        with self.server.lock:
+            self.server.requests.append((self.path, form))
+            if self.path == '/v1/prices' and self.server.failures:
+                self.server.failures -= 1
+                self.send_json(500, {'error': {'type': 'api_error', 'message': 'Stripe error.'}})
+                return
+            object_id = next(self.server.ids)
+        if self.path == '/v1/products':
+            self.send_json(200, {'id': f'prod_{object_id}', 'object': 'product', 'name': form['name']})
+        else:
+            self.send_json(200, {'id': f'price_{object_id}', 'object': 'price', 'currency': form['currency'],
+                                 'product': form['product'], 'unit_amount': int(form['unit_amount'])})
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, None))
+        self.send_json(200, {'object': 'list', 'url': '/v1/prices', 'has_more': False, 'data': self.server.prices})
+
+
+class FakeStripeTestCase(TestCase):
+    # Runs Stripe API calls against local fake Stripe HTTP server.
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStripeHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.prices = []
+        self.server.ids = itertools.count(1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        for patcher in [mock.patch('stripe.api_base', url), mock.patch('stripe.api_key', 'sk_test')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        self.product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer,
+                                              type='1')
+        self.color = Color.objects.create(name='red')
+
+    def create_variant(self, size=40):
+        return ProductShoe.objects.create(product=self.product, available=True, size=size, color=self.color)
+
+    def get_requests(self, path):
+        return [form for request_path, form in self.server.requests if request_path.startswith(path)]
+
+    def sync(self):
+        stdout = StringIO()
+        call_command('sync_stripe', stdout=stdout, stderr=stdout)
+        return stdout.getvalue()
+
+
+class StripeSyncTest(FakeStripeTestCase):
+
+    def test_changes_are_pushed_to_stripe_once(self):
+        variant = self.create_variant()
+        variant.available = False
+        variant.save()
+        self.product.save()
+        self.assertEqual(StripeSyncIntent.objects.count(), 1)
+        self.sync()
+        self.assertEqual(len(self.get_requests('/v1/products')), 1)
+        self.assertEqual(self.get_requests('/v1/prices'), [
+            {'currency': 'pln', 'product': 'prod_1', 'unit_amount': '10000'}])
+        variant.refresh_from_db()
+        self.assertEqual((variant.stripe_product_id, variant.stripe_price_id, variant.stripe_price_amount),
+                         ('prod_1', 'price_2', 10000))
+        self.assertFalse(StripeSyncIntent.objects.exists())
+        # Nothing changed - no Stripe calls.
+        variant.save()
+        self.sync()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertFalse(StripeSyncIntent.objects.exists())
+
+    def test_failed_push_is_retried(self):
+        variant = self.create_variant()
+        self.server.failures = 1
+        output = self.sync()
+        self.assertIn('Stripe error.', output)
+        intent = StripeSyncIntent.objects.get()
+        self.assertEqual(intent.attempts, 1)
+        self.assertIn('Stripe error.', intent.last_error)
+        variant.refresh_from_db()
+        # Created Stripe product is saved, so it is not created again.
+        self.assertEqual((variant.stripe_product_id, variant.stripe_price_id), ('prod_1', None))
+        self.sync()
+        variant.refresh_from_db()
+        self.assertEqual(len(self.get_requests('/v1/products')), 1)
+        self.assertEqual(len(self.get_requests('/v1/prices')), 2)
+        self.assertEqual(variant.stripe_price_id, 'price_2')
+        self.assertFalse(StripeSyncIntent.objects.exists())
+
+    def test_intents_are_processed_in_batches(self):
+        variants = [self.create_variant(size) for size in range(36, 41)]
+        self.assertEqual(sync_pending(batch_size=2, concurrency=2), (2, 2, 0))
+        self.assertEqual(StripeSyncIntent.objects.count(), 3)
+        self.assertEqual(sync_pending(batch_size=10, concurrency=2), (3, 3, 0))
+        self.assertFalse(StripeSyncIntent.objects.exists())
+        self.assertEqual(len(self.get_requests('/v1/products')), len(variants))
+        self.assertEqual(len(self.get_requests('/v1/prices')), len(variants))
+
+
+
+class StripePriceReuseTest(FakeStripeTestCase):
+
+    def set_price(self, price):
+        self.product.price = price
+        self.product.save()
+        self.sync()
+
+    def test_price_change_creates_new_price_and_reuses_known_prices(self):
+        variant = self.create_variant()
+        other = self.create_variant(41)
+        self.sync()
+        self.set_price(80)
+        variant.refresh_from_db()
+        self.assertEqual(variant.stripe_price_amount, 8000)
+        self.assertEqual([form['unit_amount'] for form in self.get_requests('/v1/prices')],
+                         ['10000', '10000', '8000', '8000'])
+        self.assertEqual(StripePrice.objects.count(), 4)
+        # Previous price is reused without Stripe calls.
+        requests = len(self.server.requests)
+        old_price = StripePrice.objects.get(stripe_product_id=variant.stripe_product_id, unit_amount=10000)
+        self.set_price(100)
+        self.assertEqual(len(self.server.requests), requests)
+        variant.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((variant.stripe_price_id, variant.stripe_price_amount),
+                         (old_price.stripe_price_id, 10000))
+        self.assertEqual(other.stripe_price_amount, 10000)
+        self.assertFalse(StripeSyncIntent.objects.exists())
+
+    def test_backfilled_prices_are_reused(self):
+        variant = self.create_variant()
+        self.sync()
+        variant.refresh_from_db()
+        self.server.prices = [
+            {'id': 'price_old', 'object': 'price', 'currency': 'pln', 'product': variant.stripe_product_id,
+             'unit_amount': 5000},
+            # Prices without amount (e.g. custom unit amount) are skipped.
+            {'id': 'price_custom', 'object': 'price', 'currency': 'pln', 'product': variant.stripe_product_id,
+             'unit_amount': None},
+        ]
+        stdout = StringIO()
+        call_command('backfill_stripe_prices', stdout=stdout)
+        self.assertIn("Loaded 1 prices", stdout.getvalue())
+        requests = len(self.server.requests)
+        self.set_price(50)
+        self.assertEqual(len(self.server.requests), requests)
+        variant.refresh_from_db()
+        self.assertEqual((variant.stripe_price_id, variant.stripe_price_amount), ('price_old', 5000))
+
+
+class ImportImagesFileNameTest(TestCase):
+
+    def test_file_names_are_matched_to_products(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        air_max = Product.objects.create(name='Air Max 90', description='Shoe', price=100, producer=producer, type='1')
+        air_max_2 = Product.objects.create(name='Air Max', description='Shoe', price=100, producer=producer, type='1')
+        self.assertEqual(get_product_keys('dir/Air Max 90_2.JPG'), ['air max 90_2', 'air max 90'])
+        self.assertEqual(get_product_keys('Air Max 90-2.jpg'), ['air max 90-2'])
+        files = ['Air Max 90.jpg', 'air max 90_3.png', 'Air Max.jpg', 'Air Max_1.jpg', f'{air_max.id}_7.jpg',
+                 'Air Max-90.jpg']
+        products = find_products({key for file in files for key in get_product_keys(file)})
+        self.assertEqual([get_product(products, file) for file in files],
+                         [air_max, air_max, air_max_2, air_max_2, air_max, None])
+
+
+class DiskCacheTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = DiskCache(directory.name, max_size=100)
+        self.created = []
+
+    def create(self, path, size=40):
+        self.created.append(path)
+        with open(path, 'wb') as file:
+            file.write(b'x' * size)
+
+    def get(self, key):
+        file = self.cache.get_or_create(key, '.webp', self.create)
+        self.addCleanup(file.close)
+        return file
+
+    def test_file_is_created_once(self):
+        self.assertEqual(self.get('a').read(), b'x' * 40)
+        self.assertEqual(self.get('a').read(), b'x' * 40)
+        self.assertEqual(len(self.created), 1)
+
+    def test_evicted_file_is_readable_and_created_again(self):
+        file = self.get('a')
+        os.utime(file.name, (0, 0))
+        self.get('b')
+        self.get('c')
+        # Eviction is not done when files are created.
+        self.assertEqual(len(self.cache.list_files()), 3)
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertFalse(os.path.exists(file.name))
+        # Opened file can still be read.
+        self.assertEqual(file.read(), b'x' * 40)
+        self.assertEqual(self.get('a').read(), b'x' * 40)
+        self.assertEqual(len(self.created), 4)
+
+
+@override_settings(CACHES=LOCAL_CACHES, PAGE_CACHE_TIMEOUT=60)
+class PageCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        self.user = User.objects.create_user(username='user', email='user@example.com', password='pass')
+        self.color = Color.objects.create(name='red')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer,
+                                                  type='1')
+            self.variant = ProductShoe.objects.create(product=self.product, available=True, size=40, color=self.color)
+        self.url = reverse('products:detail', kwargs={'pk': self.product.pk})
+
+    def get(self, url=None):
+        # Returns tuple (page content, number of queries).
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(context)
+
+    def test_anonymous_page_is_served_from_cache(self):
+        content, queries = self.get()
+        self.assertGreater(queries, 0)
+        self.assertEqual(self.get(), (content, 0))
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_pages_are_invalidated_by_product_changes(self):
+        type_url = reverse('products:type', kwargs={'product_type': 1})
+        self.get()
+        self.get(type_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Changed shoe'
+            self.product.save()
+        self.assertIn('Changed shoe', self.get()[0])
+        self.assertIn('Changed shoe', self.get(type_url)[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(product=self.product, user=self.user, value=5, comment='Great shoe')
+        self.assertIn('Great shoe', self.get()[0])
+        content, _ = self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variant.available = False
+            self.variant.save()
+        changed_content, queries = self.get()
+        self.assertGreater(queries, 0)
+        self.assertNotEqual(changed_content, content)
+
+    def test_pages_with_messages_or_cart_are_not_cached(self):
+        self.get()
+        # Rating without login adds message.
+        self.client.get(reverse('products:rate', kwargs={'pk': self.product.pk}))
+        content, queries = self.get()
+        self.assertIn("Login required.", content)
+        self.assertGreater(queries, 0)
+        content, queries = self.get()
+        self.assertNotIn("Login required.", content)
+        self.assertEqual(queries, 0)
+        self.client.get(reverse('products:add-cart', kwargs={'p_id': self.product.pk, 'ps_id': self.variant.pk}))
+        content, queries = self.get()
+        self.assertIn('badge_cart', content)
+        self.assertGreater(queries, 0)
+
+
+@override_settings(CACHES=LOCAL_CACHES, PAGE_CACHE_TIMEOUT=60)
+class ImportImagesInvalidationTest(TestCase):
+
+    def test_imported_images_invalidate_pages_and_cards(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(source.cleanup)
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        url = reverse('products:detail', kwargs={'pk': product.pk})
+        self.client.get(url)
+        self.client.get(reverse('products:type', kwargs={'product_type': 1}))
+        card_version = cache.get(get_version_key(product.id))
+        Image.new('RGB', (40, 30), 'red').save(os.path.join(source.name, 'Shoe.jpg'))
+        with override_settings(MEDIA_ROOT=media.name), self.captureOnCommitCallbacks(execute=True):
+            call_command('import_images', source.name, '--processes=1', '--set-main', stdout=StringIO())
+        image = ProductImage.objects.get(product=product)
+        self.assertNotEqual(cache.get(get_version_key(product.id)), card_version)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertGreater(len(context), 0)
+        self.assertContains(response, f"renditions/{os.path.splitext(os.path.basename(image.img.name))[0]}_")
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CacheVersionsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_card_invalidated_while_rendering_is_rendered_again(self):
+        producer = Producer.objects.create(name='Producer', address='Street 1', city='City', phone_number='1')
+        product = Product.objects.create(name='Shoe', description='Shoe', price=100, producer=producer, type='1')
+        cache.clear()
+
+        def render_invalidated(*args, **kwargs):
+            # Product changed by another request while its card is rendered.
+            invalidate_product_card(product.id)
+            return 'card'
+        with mock.patch('products.card_cache.render_to_string', side_effect=render_invalidated) as render:
+            render_product_cards([product])
+            render_product_cards([product])
+        self.assertEqual(render.call_count, 2)
+
+    def test_missing_tag_version_does_not_overwrite_bumped_version(self):
+        bump_tags('home')
+        version = cache.get(get_tag_key('home'))
+        # Version bumped after it was found missing.
+        with mock.patch.object(cache, 'get_many', return_value={}):
+            self.assertEqual(get_tag_versions(['home']), [version])
+        self.assertEqual(cache.get(get_tag_key('home')), version)
@@ -0,0 +1,291 @@
+import threading
+import time
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+# In-process index of available ProductSpecific objects of each product type. Every attribute value is mapped to
+# a bitmap of ids of available variants with this value. Bitmaps are stored as python integers, bit number n is set
+# when variant with id n is available, so filtering is done with bitwise OR (values of one attribute) and
+# AND (different attributes) operations instead of database queries.
+# For facet counts products of every combination of attribute values and every price are stored as bitmaps of product
+# ids, so counts are calculated with bitwise operations on bitmaps of a few combinations.
+# Index is updated incrementally by ProductSpecific post_save and post_delete and Product post_save signals. Version number kept in cache
+# allows other processes to notice changes and rebuild their index (requires cache shared between processes).
+
+# When more variants match filters, ids of matching products are not passed to database, products are filtered while
+# paginating instead.
+ID_LIST_LIMIT = 500
+
+
+def iter_bits(bitmap):
+    # Yield numbers of set bits in bitmap.
+    while bitmap:
+        lowest_bit = bitmap & -bitmap
+        yield lowest_bit.bit_length() - 1
+        bitmap ^= lowest_bit
+
+
+def get_lookup_field(model, lookup):
+    # Returns model field referenced by lookup e.g. 'color__name' -> Color.name.
+    field = None
+    for field_name in lookup.split('__'):
+        field = model._meta.get_field(field_name)
+        model = field.related_model
+    return field
+
+
+class VariantIndex:
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.version = None
+        self.fields = {lookup: get_lookup_field(model, lookup) for lookup in model.attribute_lookups}
+        self.clear()
+
+    def clear(self):
+        # {lookup: {value: bitmap}}
+        self.values = {lookup: {} for lookup in self.model.attribute_lookups}
+        # {variant id: product id}
+        self.variant_product = {}
+        # {product id: bitmap of available variants of product}
+        self.product_variants = {}
+        # {variant id: {lookup: value}} needed to clear bits when variant changes.
+        self.variant_values = {}
+        # Bitmap of all available variants.
+        self.available = 0
+        # Bitmaps of products used for facet counts, bit number n is set for product with id n.
+        # {tuple of attribute values: bitmap of products with available variant having these values}
+        self.combination_products = {}
+        # {tuple of attribute values: {product id: number of its available variants having these values}}
+        self.combination_counts = {}
+        # {price: bitmap of products with available variants and this price} and {product id: price}
+        self.price_products = {}
+        self.product_prices = {}
+
+    @property
+    def version_key(self):
+        return f"variant_index_version_{self.model.TYPE}"
+
+    def get_cache_version(self):
+        # Initial version is based on current time, so index is rebuilt if version was removed from cache.
+        return cache.get_or_set(self.version_key, time.time_ns(), timeout=None)
+
+    def load_rows(self, **filters):
+        return self.model.objects.filter(available=True, **filters) \
+            .values('id', 'product', 'product__effective_price', *self.model.attribute_lookups)
+
+    def build(self):
+        # Load all available variants in one query.
+        version = self.get_cache_version()
+        self.clear()
+        for row in self.load_rows():
+            self.add_bits(row)
+        self.version = version
+
+    def check_version(self):
+        # Rebuild index if it was never built or was changed by another process. Must be called with lock acquired.
+        if self.version is None or self.version != self.get_cache_version():
+            self.build()
+
+    def set_product_price(self, product_id, price):
+        old_price = self.product_prices.pop(product_id, None)
+        if old_price is not None:
+            bitmap = self.price_products[old_price] & ~(1 << product_id)
+            if bitmap:
+                self.price_products[old_price] = bitmap
+            else:
+                del self.price_products[old_price]
+        if price is not None:
+            self.product_prices[product_id] = price
+            self.price_products[price] = self.price_products.get(price, 0) | (1 << product_id)
+
+    def add_bits(self, row):
+        # Add available variant loaded by load_rows.
+        variant_id = row.pop('id')
+        product_id = self.variant_product[variant_id] = row.pop('product')
+        price = row.pop('product__effective_price')
+        self.product_variants[product_id] = self.product_variants.get(product_id, 0) | (1 << variant_id)
+        self.variant_values[variant_id] = row
+        self.available |= 1 << variant_id
+        for lookup, value in row.items():
+            self.values[lookup][value] = self.values[lookup].get(value, 0) | (1 << variant_id)
+        combination = tuple(row.values())
+        counts = self.combination_counts.setdefault(combination, {})
+        counts[product_id] = counts.get(product_id, 0) + 1
+        self.combination_products[combination] = self.combination_products.get(combination, 0) | (1 << product_id)
+        if self.product_prices.get(product_id) != price:
+            self.set_product_price(product_id, price)
+
+    def remove_bits(self, variant_id):
+        row = self.variant_values.pop(variant_id, None)
+        product_id = self.variant_product.pop(variant_id, None)
+        if product_id is not None:
+            bitmap = self.product_variants.get(product_id, 0) & ~(1 << variant_id)
+            if bitmap:
+                self.product_variants[product_id] = bitmap
+            else:
+                self.product_variants.pop(product_id, None)
+                self.set_product_price(product_id, None)
+        self.available &= ~(1 << variant_id)
+        if row is None:
+            return
+        for lookup, value in row.items():
+            bitmap = self.values[lookup].get(value, 0) & ~(1 << variant_id)
+            if bitmap:
+                self.values[lookup][value] = bitmap
+            else:
+                self.values[lookup].pop(value, None)
+        combination = tuple(row.values())
+        counts = self.combination_counts[combination]
+        counts[product_id] -= 1
+        if counts[product_id]:
+            return
+        del counts[product_id]
+        if counts:
+            self.combination_products[combination] &= ~(1 << product_id)
+        else:
+            del self.combination_counts[combination]
+            del self.combination_products[combination]
+
+    def commit_change(self):
+        new_version = self.bump_version()
+        # If another process changed index in the meantime full rebuild is required.
+        if new_version == self.version + 1:
+            self.version = new_version
+        else:
+            self.version = None
+
+    def update(self, variant_id):
+        # Update bits of one variant after it was saved or deleted.
+        with self.lock:
+            if self.version is None:
+                # Index not built in this process - it will be built on first use.
+                self.bump_version()
+                return
+            self.remove_bits(variant_id)
+            row = self.load_rows(id=variant_id).first()
+            if row is not None:
+                self.add_bits(row)
+            self.commit_change()
+
+    def update_product(self, product_id):
+        # Update price of product after it was saved.
+        with self.lock:
+            if self.version is None:
+                self.bump_version()
+                return
+            if product_id not in self.product_prices:
+                # Product without available variants is not indexed.
+                return
+            price = self.model._meta.get_field('product').related_model.objects.filter(id=product_id) \
+                .values_list('effective_price', flat=True).first()
+            if price is None or price == self.product_prices[product_id]:
+                return
+            self.set_product_price(product_id, price)
+            self.commit_change()
+
+    def bump_version(self):
+        try:
+            return cache.incr(self.version_key)
+        except ValueError:
+            version = time.time_ns()
+            cache.set(self.version_key, version, timeout=None)
+            return version
+
+    def get_selected_values(self, query_dict):
+        # Returns dictionary {lookup: set of selected values} of attributes selected in query_dict or None if some
+        # value is incorrect.
+        selected = {}
+        for lookup in self.model.attribute_lookups:
+            values = [val for val in query_dict.getlist(lookup, []) if val]
+            if not values:
+                continue
+            try:
+                selected[lookup] = {self.fields[lookup].to_python(val) for val in values}
+            except ValidationError:
+                return None
+        return selected
+
+    def filter_variants(self, query_dict):
+        # Returns bitmap of available variants matching attribute values passed in query_dict.
+        with self.lock:
+            self.check_version()
+            selected = self.get_selected_values(query_dict)
+            if selected is None:
+                # Wrong filtering parameters - no matching variants.
+                return 0
+            result = self.available
+            for lookup, values in selected.items():
+                attribute_bitmap = 0
+                for value in values:
+                    attribute_bitmap |= self.values[lookup].get(value, 0)
+                result &= attribute_bitmap
+            return result
+
+    def get_price_products(self, price_from=None, price_to=None):
+        # Returns bitmap of products with price in range. Must be called with lock acquired.
+        bitmap = 0
+        for price, products in self.price_products.items():
+            if (price_from is None or price >= price_from) and (price_to is None or price <= price_to):
+                bitmap |= products
+        return bitmap
+
+    def get_facets(self, query_dict, price_from=None, price_to=None):
+        # Returns dictionary with list of tuples (value, number of matching products) for each attribute.
+        # Products are counted with selections of all other attributes from query_dict and price range, so count
+        # shows how many products will be found after selecting the value. Counts are calculated from product bitmaps
+        # of attribute value combinations, so their cost doesn't depend on number of variants and products.
+        with self.lock:
+            self.check_version()
+            selected = self.get_selected_values(query_dict)
+            price_products = None
+            if price_from is not None or price_to is not None:
+                price_products = self.get_price_products(price_from, price_to)
+            lookups = self.model.attribute_lookups
+            facets = {}
+            for position, lookup in enumerate(lookups):
+                # {value: bitmap of products with variant having the value and matching other selections}
+                value_products = {}
+                if selected is not None:
+                    other = [(other_position, selected[other_lookup]) for other_position, other_lookup
+                             in enumerate(lookups) if other_lookup != lookup and other_lookup in selected]
+                    for combination, products in self.combination_products.items():
+                        if all(combination[other_position] in values for other_position, values in other):
+                            value = combination[position]
+                            value_products[value] = value_products.get(value, 0) | products
+                facet = []
+                for value in sorted(value for value in self.values[lookup] if value is not None):
+                    products = value_products.get(value, 0)
+                    if price_products is not None:
+                        products &= price_products
+                    facet.append((value, products.bit_count()))
+                facets[lookup] = facet
+            return facets
+
+    def get_product_filter(self, query_dict):
+        # Returns tuple (product ids, accept function) of products having at least one available variant matching
+        # query_dict. When few variants match, set of product ids is returned and accept function is None. Otherwise
+        # ids are not collected, product ids is None and accept(product_id) checks if product matches, so only
+        # products preceding requested page are checked.
+        bitmap = self.filter_variants(query_dict)
+        if bitmap.bit_count() <= ID_LIST_LIMIT:
+            with self.lock:
+                return {self.variant_product[variant_id] for variant_id in iter_bits(bitmap)
+                        if variant_id in self.variant_product}, None
+
+        def accept(product_id):
+            with self.lock:
+                return bool(self.product_variants.get(product_id, 0) & bitmap)
+        return None, accept
+
+
+variant_indexes = {}
+variant_indexes_lock = threading.Lock()
+
+
+def get_variant_index(model):
+    with variant_indexes_lock:
+        if model not in variant_indexes:
+            variant_indexes[model] = VariantIndex(model)
+        return variant_indexes[model]
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .models import Product
+
+# Variant matrix of a product - list of all variants with their attribute values and availability, used by product
+# detail page to select options without reloading the page. Matrix is kept in cache as serialized JSON with its ETag
+# and removed when variants or product change. Changes of colors invalidate all matrices by changing generation
+# number which is a part of cache keys.
+
+GENERATION_KEY = 'variant_matrix_generation'
+
+
+def get_generation():
+    return cache.get_or_set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def get_cache_key(product_id, generation=None):
+    return f"variant_matrix_{generation or get_generation()}_{product_id}"
+
+
+def build_variant_matrix(product):
+    # Returns matrix as dictionary, loads all variants of product with one query.
+    model = product.product_specific_model
+    if model is None:
+        return None
+    lookups = list(model.attribute_lookups)
+    variants = [
+        {'id': variant_id, 'available': available, 'values': [None if value is None else str(value) for value in values]}
+        for variant_id, available, *values in model.objects.filter(product=product).order_by('id')
+        .values_list('id', 'available', *lookups)
+    ]
+    return {
+        'product': product.id,
+        'attributes': lookups,
+        # All variants of a product have the same price.
+        'price': str(product.current_price),
+        'variants': variants,
+    }
+
+
+def get_variant_matrix(product_id):
+    # Returns tuple (JSON, ETag) of product variant matrix or None if product doesn't exist.
+    key = get_cache_key(product_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    product = Product.objects.filter(id=product_id).first()
+    matrix = build_variant_matrix(product) if product is not None else None
+    if matrix is None:
+        return None
+    body = json.dumps(matrix, separators=(',', ':'))
+    cached = (body, f'"{hashlib.md5(body.encode()).hexdigest()}"')
+    cache.set(key, cached, timeout=settings.VARIANT_MATRIX_CACHE_TIMEOUT)
+    return cached
+
+
+def invalidate_variant_matrix(product_id):
+    cache.delete(get_cache_key(product_id))
+
+
+def invalidate_all_variant_matrices():
+    cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
@@ -1,12 +1,25 @@
-import math
+from decimal import Decimal, InvalidOperation
 
 from django.shortcuts import render, redirect, get_object_or_404, get_list_or_404
-from .models import Product, PRODUCT_TYPES, get_product_specific_model
-from .cart import add_to_cart, clear_cart, get_cart_products_specific_list, remove_from_cart, get_cart_status
+from .models import Product, ProductImage, PRODUCT_TYPES, get_product_specific_model
+from .cart import add_to_cart, clear_cart, remove_from_cart, resolve_cart
 from .forms import RatingForm
+from .pagination import keyset_paginate, keyset_paginate_filtered
+from .detail import load_product_detail, get_comments_page
+from .variant_index import get_variant_index
+from .images import resize_image, PIL_FORMATS
+from .image_cache import resized_images_cache
+from .variant_matrix import get_variant_matrix
+from .card_cache import render_product_cards
+from .page_cache import cache_anonymous_page, get_product_tag, get_product_type_tag
+from PIL import Image
 from django.conf import settings
 from django.contrib import messages
+from django.db.models import Q
 from django.http.response import HttpResponseNotFound
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.utils.cache import get_conditional_response
 # Create your views here.
 
 
@@ -23,8 +36,8 @@ def remove_cart_view(request, p_id, ps_id):
 
 
 def cart_view(request):
-    cart_products = get_cart_products_specific_list(request)
-    cart_length, cart_value = get_cart_status(request)
+    # Load cart products and totals in one pass.
+    cart_products, cart_length, cart_value = resolve_cart(request)
     context = {
         'title': 'Cart',
         'cart_products': cart_products,
@@ -39,46 +52,61 @@ def clear_cart_view(request):
     return redirect('products:cart')
 
 
+@cache_anonymous_page(lambda request, pk: [get_product_tag(pk)])
 def product_detail_view(request, pk):
-    ORDERING = {
-        '1': '-created',  # newest
-        '2': 'created',  # oldest
-        '3': '-value',  # highest value
-        '4': 'value',   # lowest value
-    }
-    product = get_object_or_404(Product, pk=pk)
-    product_specific = product.get_product_specific_by_attributes(request.GET)
+    # Product, images, variants and first page of comments are loaded in a fixed number of queries.
+    detail = load_product_detail(pk, request.GET)
+    product = detail['product']
     # Add specific product to cart and reload the page.
     if request.GET.get('add_cart', False):
+        product_specific = None
+        if detail['selected_variant_id'] is not None:
+            product_specific = product.get_product_specific_by_id(detail['selected_variant_id'])
         response = add_to_cart(request, product_specific)
         return response
-    # Get attributes of product variants matching current selections.
-    attributes = product.get_filtered_product_specific_attributes(request.GET)
-    attribute_names = product.get_product_specific_model().get_lookup_names()
-    # create list of images with main image as first object
-    main_image = product.main_image_object
-    if main_image is not None:
-        other_images = list(product.images.exclude(id=main_image.id))
-        images = [main_image] + other_images
-    else:
-        images = None
-    # get ratings that involve a comment
-    comments = product.ratings.exclude(comment="")
-    # order comments by order parameter in query dict, default from the newest to oldest
-    order = request.GET.get('order', '1')
-    comments = comments.order_by(ORDERING.get(order, '-created'))
     context = {
         'title': 'Product Detail',
         'product': product,
-        'images': images,
-        'attributes': attributes,
-        'attribute_names': attribute_names,
-        'comments': comments,
-        'all_selected': product_specific is not None,  # check if all attribute values has been selected
+        'images': detail['images'],
+        'attributes': detail['attributes'],
+        'attribute_names': detail['attribute_names'],
+        # First page of comments, next pages are loaded by product_comments_view.
+        'comments': detail['comments'],
+        'next_comments_cursor': detail['next_comments_cursor'],
+        'comments_order': request.GET.get('order', '1'),
+        'all_selected': detail['selected_variant_id'] is not None,  # check if all attribute values has been selected
                }
     return render(request, 'products/product_detail.html', context)
 
 
+def product_comments_view(request, pk):
+    # Page of product comments as JSON, used by product detail page to load more comments.
+    comments, next_cursor = get_comments_page(pk, request.GET)
+    data = [{
+        'id': comment.id,
+        'user': str(comment.user),
+        'value_percentage': comment.value_percentage,
+        'comment': comment.comment,
+        'created': naturaltime(comment.created),
+        'editable': comment.user_id == request.user.id,
+    } for comment in comments]
+    return JsonResponse({'comments': data, 'next': next_cursor})
+
+
+def product_variants_view(request, pk):
+    # Variant matrix of product as JSON, used by product detail page to select variant without reloading the page.
+    matrix = get_variant_matrix(pk)
+    if matrix is None:
+        return HttpResponseNotFound()
+    body, etag = matrix
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = f"public, max-age={settings.VARIANT_MATRIX_MAX_AGE}"
+    return response
+
+
 def product_rate_view(request, pk):
     # check if user already rated this product
     instance = None
@@ -106,43 +134,90 @@ def product_rate_view(request, pk):
     return render(request, 'products/product_rate_form.html', context)
 
 
+def get_price_limit(query_dict, key):
+    # Returns price limit passed in query_dict as Decimal or None if it is missing or incorrect.
+    try:
+        price = Decimal(query_dict.get(key, ''))
+    except InvalidOperation:
+        return None
+    if not price.is_finite():
+        return None
+    return price
+
+
+@cache_anonymous_page(lambda request, product_type: [get_product_type_tag(product_type)])
 def product_type_view(request, product_type):
     ORDERING = {
-        '1': {'key': lambda x: x.current_price, 'reverse': False},  # Lowest price.
-        '2': {'key': lambda x: x.current_price, 'reverse': True},  # Highest price.
-        '3': {'key': lambda x: x.avg_rating, 'reverse': True},   # Best rating.
-        '4': {'key': lambda x: x.avg_rating, 'reverse': False}   # Worst rating.
+        '1': ('effective_price', 'id'),  # Lowest price.
+        '2': ('-effective_price', '-id'),  # Highest price.
+        '3': ('-avg_rating', '-id'),   # Best rating.
+        '4': ('avg_rating', 'id')   # Worst rating.
     }
-    # Get attribute values of all products of this type.
     ProductSpecific_model = get_product_specific_model(product_type)
     if ProductSpecific_model is None:
         return HttpResponseNotFound("Not found.")
-    attributes = ProductSpecific_model.get_attribute_values()
     attribute_names = ProductSpecific_model.get_lookup_names()
-    # Filter products_specific with request.GET parameters
-    filtered_products_specific = ProductSpecific_model.filter_with_query_dict(request.GET)
-    filtered_products_ids = filtered_products_specific.values_list('product', flat=True).distinct()
-    filtered_products = Product.objects.filter(id__in=filtered_products_ids)
+    # Filter products_specific with request.GET parameters using in-memory index of variants.
+    product_ids, accept_product = get_variant_index(ProductSpecific_model).get_product_filter(request.GET)
+    filtered_products = Product.objects.filter(type=ProductSpecific_model.TYPE)
+    if product_ids is not None:
+        filtered_products = filtered_products.filter(id__in=product_ids)
     # Filter products price.
-    try:
-        price_from = float(request.GET.get('price_from', ''))
-    except ValueError:
-        price_from = 0
-    try:
-        price_to = float(request.GET.get('price_to', ''))
-    except ValueError:
-        price_to = math.inf
-    filtered_products = [product for product in filtered_products if price_from <= product.current_price <= price_to]
+    price_query = Q()
+    price_from = get_price_limit(request.GET, 'price_from')
+    if price_from is not None:
+        price_query &= Q(effective_price__gte=price_from)
+    price_to = get_price_limit(request.GET, 'price_to')
+    if price_to is not None:
+        price_query &= Q(effective_price__lte=price_to)
+    filtered_products = filtered_products.filter(price_query)
+    # Get attribute values of available variants with number of matching products, calculated from the same index
+    # as product list.
+    attributes = get_variant_index(ProductSpecific_model).get_facets(request.GET, price_from, price_to)
     # Ordering products
     ordering = request.GET.get('order', '1')
-    filtered_products.sort(**ORDERING.get(ordering, ORDERING['1']))
+    # Get current page of products.
+    ordering = ORDERING.get(ordering, ORDERING['1'])
+    if accept_product is None:
+        page_products, next_cursor = keyset_paginate(filtered_products, ordering, request.GET.get('cursor'))
+    else:
+        # Many products match - they are checked with index while reading products in page order.
+        page_products, next_cursor = keyset_paginate_filtered(filtered_products, ordering, accept_product,
+                                                              request.GET.get('cursor'))
+    # Keep filters and ordering in next page url.
+    next_page_query = None
+    if next_cursor is not None:
+        query_dict = request.GET.copy()
+        query_dict['cursor'] = next_cursor
+        next_page_query = query_dict.urlencode()
     type_name = PRODUCT_TYPES[str(product_type)]
     context = {
         'title': f"Category {type_name}s",
-        'products': filtered_products,
+        'products': page_products,
+        # Rendered product cards, cached between all listing pages.
+        'cards': render_product_cards(page_products),
+        'next_page_query': next_page_query,
+        'first_page': 'cursor' not in request.GET,
         'type_name': type_name,
         'attributes': attributes,
         'attribute_names': attribute_names
     }
     return render(request, 'products/product_type.html', context)
 
+
+def resized_image_view(request, width, height, image_id, image_format):
+    # Serve product image resized to one of IMAGE_RESIZE_SIZES. Resized images are stored in disk cache.
+    if (width, height) not in settings.IMAGE_RESIZE_SIZES or image_format not in settings.IMAGE_RENDITION_FORMATS:
+        return HttpResponseNotFound()
+    image = get_object_or_404(ProductImage.objects.only('img'), id=image_id)
+    # Uploaded file name is part of the key, so cached images of replaced upload are not used.
+    key = f"{image.img.name}:{width}x{height}"
+    try:
+        file = resized_images_cache.get_or_create(
+            key, PIL_FORMATS[image_format][1],
+            lambda path: resize_image(image.img.path, (width, height), path, image_format))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return HttpResponseNotFound()
+    response = FileResponse(file, content_type=f"image/{image_format}")
+    response['Cache-Control'] = f"public, max-age={settings.IMAGE_RESIZE_MAX_AGE}"
+    return response
@@ -1,4 +1,5 @@
 from products.models import PRODUCT_TYPES
+from products.cart import get_cart_length
 from django.utils.http import urlsafe_base64_encode
 
 
@@ -15,3 +16,8 @@ def uidb64_context(request):
         context['uidb64'] = uidb64
     return context
 
+
+def cart_context(request):
+    context = dict()
+    context['cart_length'] = get_cart_length(request)
+    return context
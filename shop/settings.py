@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     'users',
     'orders',
     'api',
+    'mailing',
 
     #other
     'crispy_forms',
@@ -86,7 +87,8 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 # custom context processors
                 'shop.context_processors.products_context',
-                'shop.context_processors.uidb64_context'
+                'shop.context_processors.uidb64_context',
+                'shop.context_processors.cart_context'
             ],
         },
     },
@@ -111,6 +113,27 @@ DATABASES = {
 }
 
 
+# Cache must be shared by all processes - variant index versions, carts, pages and product cards are changed by web
+# workers, admin and management commands. Redis is used when REDIS_URL is set (requires redis package), database
+# table otherwise (created with "python manage.py createcachetable").
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_table',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -161,6 +184,20 @@ CRISPY_TEMPLATE_PACK = "bootstrap4"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Renditions of product images created by process_images command: {name: (max width, max height)}.
+IMAGE_RENDITIONS = {
+    'thumbnail': (100, 100),
+    'card': (320, 320),
+    'detail': (600, 600),
+    'detail_2x': (1200, 1200),
+}
+# Formats of renditions with encoder quality.
+IMAGE_RENDITION_FORMATS = {'webp': 80, 'jpeg': 85}
+# Sizes allowed in /media/r/<width>x<height>/<image id>.<format> urls of images resized on demand.
+IMAGE_RESIZE_SIZES = {(100, 100), (160, 160), (320, 320), (480, 480), (600, 600), (1200, 1200)}
+IMAGE_RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'resized_images')
+IMAGE_RESIZE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+IMAGE_RESIZE_MAX_AGE = 60*60*24
 
 LOGIN_URL = '/users/login'
 
@@ -178,13 +215,41 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 EMAIL_FILE_PATH = BASE_DIR / "sent_emails"
 
+# Emails are saved in outbox and sent by "send_emails" management command.
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+# Seconds for which emails claimed by send_emails worker are not picked by other workers.
+EMAIL_OUTBOX_LEASE_TIME = 60*10
+
 
 PASSWORD_RESET_TIMEOUT = 5*60
 ACCOUNT_ACTIVATION_TIMEOUT = 60*60*24
 ORDER_CONFIRMATION_TIMEOUT = 60*60*24
+CART_CACHE_TIMEOUT = 60*60*24
+# Anonymous carts not modified for this number of seconds are removed by "prune_carts" command.
+CART_ANONYMOUS_MAX_AGE = 60*60*24*30
+VARIANT_MATRIX_CACHE_TIMEOUT = 60*60
+# Browser cache time of variant matrix, revalidated with ETag after that.
+VARIANT_MATRIX_MAX_AGE = 60
+# Cache time of pages rendered for anonymous visitors, 0 disables page cache.
+PAGE_CACHE_TIMEOUT = 60*10
+PRODUCT_CARD_CACHE_TIMEOUT = 60*60*24
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_CURRENCY = 'pln'
+# Maximum number of parallel Stripe requests made by sync_stripe command.
+STRIPE_SYNC_CONCURRENCY = 8
+# Stripe checkout timeouts (seconds) and circuit breaker limits of send_payment_links command.
+STRIPE_CONNECT_TIMEOUT = 5
+STRIPE_READ_TIMEOUT = 30
+STRIPE_FAILURE_THRESHOLD = 3
+STRIPE_RESET_TIMEOUT = 30
+# Stripe webhook event which failed this many times is skipped by process_stripe_events command.
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+# Address of the site used in links created outside of requests.
+SITE_URL = os.getenv('SITE_URL', 'https://tczosnyka.eu.pythonanywhere.com')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
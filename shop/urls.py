@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from products.views import resized_image_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +27,9 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path('', include('pages.urls')),
     path('api/', include('api.urls')),
+    # Must be placed before media files served in DEBUG mode.
+    path(f"{settings.MEDIA_URL.strip('/')}/r/<int:width>x<int:height>/<int:image_id>.<str:image_format>",
+         resized_image_view, name='resized-image'),
 ]
 #img patterns
 if settings.DEBUG:
@@ -5,7 +5,7 @@ from django.contrib import messages
 from django.urls import NoReverseMatch
 from django.contrib.auth.models import User
 from django.db.models import ObjectDoesNotExist
-from django.core.mail import send_mail
+from mailing.models import enqueue_email
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.contrib.auth.forms import SetPasswordForm, PasswordChangeForm
@@ -14,6 +14,7 @@ from django.http import HttpResponseForbidden, HttpResponse, HttpResponseNotFoun
 from django.conf import settings
 from .token_generator import account_activation_token_generator
 from django.utils import timezone
+from products.pagination import keyset_paginate
 
 
 # Create your views here.
@@ -36,9 +37,9 @@ def send_activation_link(request, user):
     token = account_activation_token_generator.make_token(user=user)
     uidb64 = urlsafe_base64_encode(str(user.id).encode())
     url = request.build_absolute_uri(f'/users/activate/{uidb64}/{token}')
-    user.email_user(subject="Account activation link",
-                    message=f"Follow this link to activate your account:\n{url}",
-                    from_email="Django MyShop")
+    enqueue_email(subject="Account activation link",
+                  message=f"Follow this link to activate your account:\n{url}",
+                  from_email="Django MyShop", recipient_list=[user.email])
 
 
 def account_activate_view(request, uidb64, token):
@@ -156,19 +157,15 @@ def reset_insert_email_view(request):
             uidb64 = urlsafe_base64_encode(str(user.id).encode())
             token = default_token_generator.make_token(user=user)
             url = request.build_absolute_uri(f'/users/reset/{uidb64}/{token}')
-            sent = send_mail(
+            enqueue_email(
                 'Password reset link',
                 f'Click this link to reset your password:\n'
                 f'{url}',
                 'django-e-shop',
                 [user.email],
-                fail_silently=False,
             )
-            if sent:
-                messages.success(request, f"Password reset email has been sent to address {user.email}.")
-                return redirect('pages:home')
-            else:
-                messages.warning(request, f"Error while sending email to address {user.email}")
+            messages.success(request, f"Password reset email has been sent to address {user.email}.")
+            return redirect('pages:home')
     context = {
         'title': 'Insert email',
         'form': form
@@ -269,25 +266,28 @@ def change_data_view(request, uidb64):
 def users_orders_list(request, uidb64):
 
     ORDERING = {
-        '1': '-created',  # newest
-        '2': 'created',  # oldest
-        # sort by total value object property
-        '3': {'key': lambda x: x.total_value, 'reverse': True},  # highest value
-        '4':  {'key': lambda x: x.total_value, 'reverse': False},   # lowest value
+        '1': ('-created', '-id'),  # newest
+        '2': ('created', 'id'),  # oldest
+        '3': ('-total_value', '-id'),  # highest value
+        '4': ('total_value', 'id'),   # lowest value
     }
     user, error_response = check_user(request, uidb64)
     if error_response is not None:
         return error_response
     orders_list = Order.objects.filter(user=user)
-    # sort orders list by their total value which is property not a field
+    # Get current page of orders sorted in database.
     ordering = request.GET.get('order', '1')
-    if ordering == '3' or ordering == '4':
-        orders_list = list(orders_list)
-        orders_list.sort(**ORDERING[ordering])
-    else:
-        orders_list = orders_list.order_by(ORDERING.get(ordering, '-created'))
+    orders_list, next_cursor = keyset_paginate(orders_list, ORDERING.get(ordering, ORDERING['1']),
+                                               request.GET.get('cursor'))
+    next_page_query = None
+    if next_cursor is not None:
+        query_dict = request.GET.copy()
+        query_dict['cursor'] = next_cursor
+        next_page_query = query_dict.urlencode()
     context = {
         'title': 'Your Orders',
         'orders_list': orders_list,
+        'next_page_query': next_page_query,
+        'first_page': 'cursor' not in request.GET,
     }
     return render(request, 'users/orders.html', context)